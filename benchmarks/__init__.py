@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks for discordplays
+~~~~~~~~~~~~~~~~~~~
+:copyright: (c) 2019 i-question-this
+:license: GPL-3.0, see LICENSE for more details.
+"""
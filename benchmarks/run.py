@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmarks for the emulation, capture, encoding and voting paths
+~~~~~~~~~~~~~~~~~~~
+Runs offline against SyntheticEmulator, no ROMs needed.
+
+  python -m benchmarks.run --output results.json
+
+:copyright: (c) 2019 i-question-this
+:license: GPL-3.0, see LICENSE for more details.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from discordplays.emulatorControllerGroup import EmulatorControllerGroup
+from discordplays.emulators.capturePolicy import CapturePolicy
+from discordplays.emulators.action import Action
+from discordplays.emulators.dmg import dmgPalette, dmgShades
+from discordplays.emulators.emulator import Emulator
+from discordplays.emulators.frameRing import FrameRing
+from discordplays.emulators.gifEncoder import GIFEncoder
+from discordplays.emulators.inputSchedule import InputSchedule
+from discordplays.emulators.syntheticEmulator import SyntheticEmulator
+from discordplays.gamelibrary import ConsoleType
+from discordplays.romIndex import RomIndex
+from discordplays.votingbox import VotingBox
+from PIL import Image
+
+
+class BenchmarkChannel:
+  """Stands in for a Discord channel, reading uploads like discord.py"""
+  def __init__(self, idNumber:int):
+    self.id = idNumber
+
+
+  async def send(self, text:str, file=None) -> None:
+    if file is not None:
+      file.fp.read()
+
+
+
+dmgSize = (160, 144)
+
+
+def dmgFrames(numberOfFrames:int) -> list:
+  """Distinct frames of shade indexes, a tiled pattern scrolling along"""
+  width, height = dmgSize
+  tiles = bytes(
+    (x // 8 + y // 8) % len(dmgShades)
+    for y in range(height) for x in range(width)
+  )
+  return [tiles[i:] + tiles[:i] for i in range(numberOfFrames)]
+
+
+def encodeFrames(frames:list, mode:str, palette:bytes=None) -> tuple:
+  """(seconds, bytes) to encode frames as a clip, 50 ms each"""
+  ring = FrameRing.allocate(len(frames[0]), 64)
+  output = io.BytesIO()
+  start = time.perf_counter()
+  encoder = GIFEncoder(output, ring, mode, dmgSize, palette)
+  for frame in frames:
+    ring.write(frame, 50)
+  encoder.finish()
+  return time.perf_counter() - start, len(output.getvalue())
+
+
+def startedEmulator() -> Emulator:
+  emulator = SyntheticEmulator()
+  emulator.start("benchmark", None, None, 0)
+  return emulator
+
+
+# Benchmarks
+def benchmarkTickOnly(numberOfFrames:int) -> dict:
+  emulator = startedEmulator()
+  start = time.perf_counter()
+  emulator.runFrames(numberOfFrames)
+  seconds = time.perf_counter() - start
+  emulator.stop()
+  return {
+    "frames": numberOfFrames,
+    "seconds": seconds,
+    "framesPerSecond": numberOfFrames / seconds
+  }
+
+
+def benchmarkTickAndCapture(numberOfFrames:int, captureEvery:int) -> dict:
+  emulator = startedEmulator()
+  start = time.perf_counter()
+  emulator.runFrames(numberOfFrames, captureEvery)
+  clip = emulator.makeGIF()
+  seconds = time.perf_counter() - start
+  emulator.stop()
+  return {
+    "frames": numberOfFrames,
+    "captureEvery": captureEvery,
+    "seconds": seconds,
+    "framesPerSecond": numberOfFrames / seconds,
+    "framesEncoded": clip.stats.framesEncoded
+  }
+
+
+def benchmarkClip(numberOfSeconds:float, targetFps:float) -> dict:
+  """A clip of numberOfSeconds, against running as many frames uncaptured
+
+  The encoder works alongside the emulator, so the overhead of a clip is
+  the whole run and finish against the tick only run. encodeSeconds is
+  the time the encoder thread spent busy, finishSeconds what makeGIF
+  waited for it at the end.
+  """
+  emulator = startedEmulator()
+  start = time.perf_counter()
+  emulator.runForXSeconds(numberOfSeconds, CapturePolicy.none())
+  tickSeconds = time.perf_counter() - start
+
+  start = time.perf_counter()
+  emulator.runForXSeconds(numberOfSeconds, CapturePolicy(targetFps=targetFps))
+  finishStart = time.perf_counter()
+  clip = emulator.makeGIF()
+  end = time.perf_counter()
+  emulator.stop()
+  return {
+    "clipSeconds": numberOfSeconds,
+    "targetFps": targetFps,
+    "tickSeconds": tickSeconds,
+    "seconds": end - start,
+    "overheadSeconds": end - start - tickSeconds,
+    "encodeSeconds": clip.stats.encodeSeconds,
+    "finishSeconds": end - finishStart,
+    "bytes": len(clip.data),
+    "framesCaptured": clip.stats.framesCaptured,
+    "framesEncoded": clip.stats.framesEncoded,
+    "framesCollapsed": clip.stats.framesCollapsed
+  }
+
+
+def benchmarkPalette(numberOfFrames:int) -> dict:
+  """Game Boy frames encoded against the fixed palette, and as RGB frames
+  quantized one by one like makeGIF did before
+  """
+  frames = dmgFrames(numberOfFrames)
+  rgbFrames = []
+  for frame in frames:
+    image = Image.frombytes("P", dmgSize, frame)
+    image.putpalette(dmgPalette)
+    rgbFrames.append(image.convert("RGB").tobytes())
+  paletteSeconds, paletteBytes = encodeFrames(frames, "P", dmgPalette)
+  quantizeSeconds, quantizeBytes = encodeFrames(rgbFrames, "RGB")
+  return {
+    "frames": numberOfFrames,
+    "paletteSeconds": paletteSeconds,
+    "paletteBytes": paletteBytes,
+    "quantizeSeconds": quantizeSeconds,
+    "quantizeBytes": quantizeBytes,
+    "speedUp": quantizeSeconds / paletteSeconds
+  }
+
+
+def benchmarkSchedule(numberOfPresses:int, secondsAfter:float) -> dict:
+  emulator = startedEmulator()
+  schedule = InputSchedule.fromVote(
+    (Action.PRESS, "a", numberOfPresses),
+    emulator.fps,
+    secondsAfter
+  )
+  start = time.perf_counter()
+  emulator.runSchedule(schedule)
+  seconds = time.perf_counter() - start
+  emulator.stop()
+  return {
+    "presses": numberOfPresses,
+    "frames": schedule.numberOfFrames,
+    "seconds": seconds,
+    "framesPerSecond": schedule.numberOfFrames / seconds
+  }
+
+
+def benchmarkVoting(numberOfVotes:int, numberOfChoices:int) -> dict:
+  votes = [("press", "button{}".format(user % numberOfChoices), 1)
+      for user in range(numberOfVotes)]
+  votingBox = VotingBox()
+  start = time.perf_counter()
+  for user, vote in enumerate(votes):
+    votingBox.castVote(user, vote)
+  castSeconds = time.perf_counter() - start
+  start = time.perf_counter()
+  votingBox.majorityVoteResult()
+  closeSeconds = time.perf_counter() - start
+  bulkVotingBox = VotingBox()
+  start = time.perf_counter()
+  bulkVotingBox.castVotes(enumerate(votes))
+  bulkSeconds = time.perf_counter() - start
+  return {
+    "votes": numberOfVotes,
+    "choices": numberOfChoices,
+    "votesPerSecond": numberOfVotes / castSeconds,
+    "bulkVotesPerSecond": numberOfVotes / bulkSeconds,
+    "closeSeconds": closeSeconds
+  }
+
+
+async def benchmarkControllers(numberOfControllers:int) -> dict:
+  group = EmulatorControllerGroup()
+  for channelId in range(numberOfControllers):
+    group.createController(BenchmarkChannel(channelId))
+  controllers = [group.findControllerById(idNumber)
+      for idNumber in range(numberOfControllers)]
+
+  # Every controller plays the same game, as happens with popular ones
+  romIndex = RomIndex()
+  with tempfile.TemporaryDirectory() as directory:
+    gameROMPath = os.path.join(directory, "benchmark.gb")
+    with open(gameROMPath, "wb") as f:
+      f.write(bytes(32 * 1024))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(
+      controller.start(ConsoleType.SYNTHETIC, romIndex.identify(gameROMPath), None)
+      for controller in controllers
+    ))
+    await asyncio.gather(*(
+      controller.sendScreenShotGif() for controller in controllers
+    ))
+    seconds = time.perf_counter() - start
+    await group.closeAll()
+  return {
+    "controllers": numberOfControllers,
+    "seconds": seconds,
+    "secondsPerController": seconds / numberOfControllers
+  }
+
+
+def runAll(quick:bool=False) -> dict:
+  scale = 10 if quick else 1
+  return {
+    "tickOnly": [benchmarkTickOnly(36000 // scale)],
+    "tickAndCapture": [
+      benchmarkTickAndCapture(3600 // scale, captureEvery)
+      for captureEvery in (1, 3)
+    ],
+    "clip": [
+      benchmarkClip(numberOfSeconds, 20)
+      for numberOfSeconds in (1, 10, 60 // scale)
+    ],
+    "palette": [benchmarkPalette(300 // scale)],
+    "schedule": [
+      benchmarkSchedule(numberOfPresses, 10)
+      for numberOfPresses in (1, 25)
+    ],
+    "voting": [
+      benchmarkVoting(numberOfVotes // scale, 16)
+      for numberOfVotes in (1000, 100000)
+    ],
+    "controllers": [
+      asyncio.run(benchmarkControllers(numberOfControllers))
+      for numberOfControllers in (1, 16 // scale + 1)
+    ]
+  }
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+  parser.add_argument("--output", help="Write results as JSON to this file")
+  parser.add_argument("--quick", action="store_true",
+      help="Run a tenth of the work, for smoke testing")
+  arguments = parser.parse_args()
+
+  results = {
+    "python": sys.version.split()[0],
+    "platform": platform.platform(),
+    "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    "results": runAll(arguments.quick)
+  }
+
+  text = json.dumps(results, indent=2)
+  if arguments.output is not None:
+    with open(arguments.output, "w") as f:
+      f.write(text + "\n")
+  print(text)
+
+
+if __name__ == "__main__":
+  main()
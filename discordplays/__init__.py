@@ -15,16 +15,84 @@ __version__ = '0.14.0'
 
 from collections import namedtuple
 
+import atexit
 import discord
 import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
 
 VersionInfo = namedtuple('VersionInfo', 'major minor micro')
 
 version_info = VersionInfo(major=0, minor=14, micro=0)
 
+# Logging
+# Records queued for the writer thread, beyond this many they are dropped
+logQueueSize = 10000
+# The log rotates at this size, keeping this many old logs
+logFileSize = 10 * 1024 * 1024
+logFileBackups = 5
+# Level of each subsystem, discord itself is discord.py
+logLevels = {
+  "discord": logging.INFO,
+  "discord.plays.bot": logging.INFO,
+  "discord.plays.controller": logging.INFO,
+  "discord.plays.emulators": logging.INFO,
+  "discord.plays.metrics": logging.INFO,
+  "discord.plays.storage": logging.INFO
+}
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+  """Hands records to a QueueListener without formatting or blocking
+
+  Formatting is left to the listener's thread, so records must only carry
+  arguments that do not change after logging. Records that do not fit in
+  the queue are counted and dropped instead of stalling the caller.
+  """
+  def __init__(self, logQueue:queue.Queue):
+    super().__init__(logQueue)
+    self.numberOfDroppedRecords = 0
+
+
+  def prepare(self, record:logging.LogRecord) -> logging.LogRecord:
+    return record
+
+
+  def enqueue(self, record:logging.LogRecord) -> None:
+    try:
+      self.queue.put_nowait(record)
+    except queue.Full:
+      self.numberOfDroppedRecords += 1
+
+
+
+def getLogger(subsystem:str) -> logging.Logger:
+  """Logger of a subsystem, its level is set in logLevels"""
+  return logger.getChild("plays").getChild(subsystem)
+
+
 # Set up logging for Discord
 logger = logging.getLogger('discord')
-logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler(filename='discord.log', encoding='utf-8', mode='w')
-handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-logger.addHandler(handler)
+for name, level in logLevels.items():
+  logging.getLogger(name).setLevel(level)
+# Emulator host processes import this package too, they must not touch the log
+if multiprocessing.parent_process() is None:
+  fileHandler = logging.handlers.RotatingFileHandler(
+    filename='discord.log',
+    encoding='utf-8',
+    maxBytes=logFileSize,
+    backupCount=logFileBackups,
+    delay=True
+  )
+  fileHandler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
+  # Every run starts a fresh log, like it always has
+  if os.path.exists(fileHandler.baseFilename):
+    fileHandler.doRollover()
+  # The file is only written by the listener's thread
+  queueHandler = DroppingQueueHandler(queue.Queue(logQueueSize))
+  logger.addHandler(queueHandler)
+  logListener = logging.handlers.QueueListener(queueHandler.queue, fileHandler)
+  logListener.start()
+  atexit.register(logListener.stop)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+"""
+Writes save states in the background
+~~~~~~~~~~~~~~~~~~~
+:copyright: (c) 2019 i-question-this
+:license: GPL-3.0, see LICENSE for more details.
+"""
+import os
+import tempfile
+import threading
+from . import getLogger
+
+logger = getLogger("storage")
+
+
+def writeAtomically(filePath:str, data:bytes) -> None:
+  """Replaces filePath with data, leaving either the old or the new file
+
+  The data goes to a temporary file in the same directory, which is synced
+  to disk before being renamed over filePath.
+  """
+  directory = os.path.dirname(os.path.abspath(filePath))
+  fd, temporaryPath = tempfile.mkstemp(
+    prefix=".{}.".format(os.path.basename(filePath)),
+    suffix=".tmp",
+    dir=directory
+  )
+  try:
+    with os.fdopen(fd, "wb") as f:
+      f.write(data)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(temporaryPath, filePath)
+  except BaseException:
+    os.unlink(temporaryPath)
+    raise
+  # Make the rename itself durable, where directories can be opened
+  if hasattr(os, "O_DIRECTORY"):
+    directoryFd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+      os.fsync(directoryFd)
+    finally:
+      os.close(directoryFd)
+
+
+
+class Autosaver:
+  """Writes save states to disk on a background thread
+
+  Only the newest state asked for is kept, so requests made while a write
+  is in progress coalesce into a single write once it finishes. The thread
+  is started by the first request.
+  """
+  # Magic Methods
+  def __init__(self, name:str="Autosaver"):
+    self._condition = threading.Condition()
+    self._pending = None
+    self._isWriting = False
+    self._isClosed = False
+    self._error = None
+    self._name = name
+    self._thread = None
+
+
+  # Saving
+  def request(self, filePath:str, state:bytes) -> None:
+    """Queues state to be written to filePath, replacing any queued state"""
+    with self._condition:
+      if self._isClosed:
+        raise ValueError("Autosaver is closed")
+      if self._pending is not None:
+        logger.info("%s: Coalesced save to '%s'",
+          self.__class__.__name__,
+          self._pending[0]
+        )
+      self._pending = (filePath, state)
+      self._condition.notify_all()
+      if self._thread is None:
+        self._thread = threading.Thread(
+          target=self._writeStates,
+          name=self._name,
+          daemon=True
+        )
+        self._thread.start()
+
+
+  def flush(self, timeout:float=None) -> bool:
+    """Waits until every requested state is written, False on timeout
+
+    Raises the error of the last write if it failed.
+    """
+    with self._condition:
+      isFlushed = self._condition.wait_for(
+        lambda: self._pending is None and not self._isWriting,
+        timeout
+      )
+      error, self._error = self._error, None
+    if error is not None:
+      raise error
+    return isFlushed
+
+
+  def close(self) -> None:
+    """Writes what is queued, then stops the thread"""
+    with self._condition:
+      self._isClosed = True
+      self._condition.notify_all()
+      thread = self._thread
+    if thread is not None:
+      thread.join()
+
+
+  def _writeStates(self) -> None:
+    while True:
+      with self._condition:
+        self._condition.wait_for(
+          lambda: self._pending is not None or self._isClosed
+        )
+        if self._pending is None:
+          return
+        filePath, state = self._pending
+        self._pending = None
+        self._isWriting = True
+
+      error = None
+      try:
+        writeAtomically(filePath, state)
+        logger.info("%s: Saved %s bytes to '%s'",
+          self.__class__.__name__,
+          len(state),
+          filePath
+        )
+      except Exception as e:
+        error = e
+        logger.exception("%s: Failed to save to '%s'",
+          self.__class__.__name__,
+          filePath
+        )
+      finally:
+        with self._condition:
+          self._error = error
+          self._isWriting = False
+          self._condition.notify_all()
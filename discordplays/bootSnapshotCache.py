@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cache of save states taken just after booting a game
+~~~~~~~~~~~~~~~~~~~
+:copyright: (c) 2019 i-question-this
+:license: GPL-3.0, see LICENSE for more details.
+"""
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Hashable
+from . import getLogger
+
+logger = getLogger("storage")
+
+
+class BootSnapshotCache:
+  """Compressed post boot save states, least recently used evicted first
+
+  Keys are (console, game ROM digest, boot ROM digest, battery save
+  digest). Every copy of a game with the same battery save boots from the
+  same snapshot, while saving in game changes the key so the next boot is
+  cold. Controllers boot on their own worker threads, so every access
+  takes the lock.
+  """
+  compressionLevel = 1
+
+  # Magic Methods
+  def __init__(self, maxBytes:int):
+    if maxBytes <= 0:
+      raise ValueError("maxBytes must be greater than 0")
+
+    self._maxBytes = maxBytes
+    self._snapshots = OrderedDict()
+    self._numberOfBytes = 0
+    self._lock = threading.Lock()
+
+
+  def __len__(self) -> int:
+    return len(self._snapshots)
+
+
+  # Properties
+  @property
+  def numberOfBytes(self) -> int:
+    return self._numberOfBytes
+
+
+  # Snapshots
+  def get(self, key:Hashable) -> bytes:
+    """The save state stored under key, or None"""
+    with self._lock:
+      snapshot = self._snapshots.get(key)
+      if snapshot is None:
+        return None
+      self._snapshots.move_to_end(key)
+    return zlib.decompress(snapshot)
+
+
+  def put(self, key:Hashable, state:bytes) -> None:
+    snapshot = zlib.compress(state, self.compressionLevel)
+    if len(snapshot) > self._maxBytes:
+      logger.warning("%s: Snapshot of %s bytes is over the %s byte budget",
+        self.__class__.__name__,
+        len(snapshot),
+        self._maxBytes
+      )
+      return
+    with self._lock:
+      previous = self._snapshots.pop(key, None)
+      if previous is not None:
+        self._numberOfBytes -= len(previous)
+      self._snapshots[key] = snapshot
+      self._numberOfBytes += len(snapshot)
+      while self._numberOfBytes > self._maxBytes:
+        _, evicted = self._snapshots.popitem(last=False)
+        self._numberOfBytes -= len(evicted)
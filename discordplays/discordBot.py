@@ -10,12 +10,16 @@ import discord
 import discord.ext.commands as commands
 import os
 from functools import partial
-from . import logger, version_info
+import discordplays
+from . import getLogger, version_info
 from .emulatorController import ChannelAlreadyRegistered, ChannelNotRegistered
 from .emulatorControllerGroup import ControllerNotFoundByChannel, ControllerNotFoundByIdNumber, EmulatorControllerGroup
 from .gamelibrary import ConsoleType, FileNotFound, FileType, GameLibrary
 from .emulators.action import Action
 from .emulators.emulator import ButtonCode, ButtonNotRecognized
+from .metrics import MetricsExporter, registry
+
+logger = getLogger("bot")
 
 
 # Exceptions
@@ -37,7 +41,38 @@ bot = commands.Bot(
 bot.gameLibrary = GameLibrary()
 
 # The controller of all the emulators
-bot.emulatorControllerGroup = EmulatorControllerGroup()
+# Set isolateEmulators to run every emulator in its own process
+isolateEmulators = False
+# Keyword arguments emulators of each console are made with, the synthetic
+# one's frameCost and saveStateSize set the load it puts on the bot
+emulatorOptions = {
+  ConsoleType.SYNTHETIC: {"frameCost": 0, "saveStateSize": 16 * 1024}
+}
+bot.emulatorControllerGroup = EmulatorControllerGroup(
+  isolateEmulators,
+  emulatorOptions
+)
+
+# Metrics
+# Set metricsFilePath to write a Prometheus textfile collector file, and
+# metricsPort to serve /metrics on localhost
+metricsFilePath = None
+metricsPort = None
+bot.metricsExporter = None
+registry.gauge(
+  "discordplays_running_emulators",
+  "Emulators running right now",
+  lambda: bot.emulatorControllerGroup.numberOfRunningEmulators
+)
+registry.gauge(
+  "discordplays_log_records_dropped",
+  "Log records dropped because the log queue was full",
+  lambda: getattr(
+    getattr(discordplays, "queueHandler", None),
+    "numberOfDroppedRecords",
+    0
+  )
+)
 
 # Setting status messages
 async def setStatusMessage() -> None:
@@ -180,12 +215,26 @@ async def buttonPush(ctx:commands.Context, buttonName:str,
 
 
 ## Game Library
+def describeLibraryFile(libraryFile) -> str:
+  description = "{} ({} KiB)".format(libraryFile.name, libraryFile.size // 1024)
+  header = libraryFile.header
+  if header is not None:
+    description += " '{}'{} type 0x{:02X}{}".format(
+      header.title,
+      " CGB" if header.cgbFlag & 0x80 else "",
+      header.cartridgeType,
+      "" if header.isHeaderChecksumValid else " bad checksum"
+    )
+  return description
+
+
+romsPerPage = 25
 @bot.command(
   name="listRoms",
-  help="List avaialbe ROMs"
+  help="List avaialbe ROMs, {} per page, only those containing search if given".format(romsPerPage)
 )
 async def listROMs(ctx:commands.Context, consoleType:ConsoleType=None,
-     fileType:FileType=None) -> None:
+     fileType:FileType=None, page:int=1, search:str=None) -> None:
   if consoleType is None:
     consoleTypeList = ConsoleType
   else:
@@ -196,17 +245,21 @@ async def listROMs(ctx:commands.Context, consoleType:ConsoleType=None,
   else:
     fileTypeList = [fileType]
 
-  # Send the info
-  message = ""
+  # Every line, with headings, then just the page asked for
+  lines = []
   for consoleType in consoleTypeList:
-    message += "{}::\n".format(consoleType.value)
+    lines.append("{}::".format(consoleType.value))
     for fileType in fileTypeList:
-      message += "  {}:\n".format(fileType.value)
+      lines.append("  {}:".format(fileType.value))
+      files = ctx.bot.gameLibrary.files(consoleType, fileType, search)
+      lines.extend("    {}".format(describeLibraryFile(f)) for f in files)
 
-      files = ctx.bot.gameLibrary.availableFiles(consoleType, fileType)
-      message += "\n".join(("    {}".format(f) for f in files))
-      message += "\n"
+  numberOfPages = max(1, -(-len(lines) // romsPerPage))
+  page = min(max(page, 1), numberOfPages)
+  message = "\n".join(lines[(page - 1) * romsPerPage:page * romsPerPage])
+  message += "\nPage {} of {}".format(page, numberOfPages)
 
+  # Send the info
   await ctx.message.channel.send(message)
 
 ## Controller
@@ -262,9 +315,9 @@ async def startROM(ctx:commands.Context, consoleType:ConsoleType,
   # Find controller
   controller = getControllerForMessageContext(ctx)
 
-  # Construct file paths, errors if path not correct
-  gameROMPath = ctx.bot.gameLibrary.filePath(consoleType, FileType.GAMES, gameROM)
-  bootROMPath = ctx.bot.gameLibrary.filePath(consoleType, FileType.BOOTS, bootROM)
+  # Confirm the ROMs exist, errors if not
+  ctx.bot.gameLibrary.filePath(consoleType, FileType.GAMES, gameROM)
+  ctx.bot.gameLibrary.filePath(consoleType, FileType.BOOTS, bootROM)
   if saveFileName is not None:
     try:
       saveFilePath = ctx.bot.gameLibrary.filePath(consoleType, FileType.SAVES, saveFileName)
@@ -277,7 +330,9 @@ async def startROM(ctx:commands.Context, consoleType:ConsoleType,
     newSaveFile = False
   # Specification correct, start the game 
   await setStatusMessage()
-  controller.start(consoleType, gameROMPath, bootROMPath, saveFilePath, newSaveFile)
+  gameROMFile = ctx.bot.gameLibrary.identifyROM(consoleType, FileType.GAMES, gameROM)
+  bootROMFile = ctx.bot.gameLibrary.identifyROM(consoleType, FileType.BOOTS, bootROM)
+  await controller.start(consoleType, gameROMFile, bootROMFile, saveFilePath, newSaveFile)
   # Send first screen shot
   await controller.sendScreenShotGif()
   
@@ -291,7 +346,7 @@ async def stopROM(ctx:commands.Context) -> None:
   # Find controller
   controller = getControllerForMessageContext(ctx)
   # Stop emulator
-  controller.stop()
+  await controller.stop()
   await setStatusMessage()
 
 @bot.command(
@@ -309,9 +364,27 @@ async def saveState(ctx:commands.Context, saveStateName:str=None) -> None:
   if controller.saveStateFilePath is None:
       await ctx.send("No prioer save state file name specified, can not save with implicit name")
 
-  controller.saveState()
+  await controller.saveState()
   await ctx.send("State saved to: {}".format(controller.saveStateFilePath))
 
+@bot.command(
+  name="rewind",
+  help="Undoes the last 'x' voting rounds, as far back as snapshots go."
+)
+@commands.check(isEmulatorRunning)
+async def rewind(ctx:commands.Context, numberOfRounds:int=1) -> None:
+  # Find controller
+  controller = getControllerForMessageContext(ctx)
+  if controller.numberOfSnapshots == 0:
+    await ctx.send("No rounds to rewind")
+    return None
+  if controller.isRoundInProgress:
+    await ctx.send("Can not rewind while a round is being voted on")
+    return None
+  # Conform rounds to the snapshots kept
+  numberOfRounds = min(max(numberOfRounds, 1), controller.numberOfSnapshots)
+  await controller.rewind(numberOfRounds)
+
 minBP = 0.5
 maxBP = 10
 @bot.command(
@@ -327,6 +400,21 @@ async def setNumberOfSecondsAfterButtonPress(ctx:commands.Context, length:float)
   await controller.setNumberOfSecondsAfterButtonPress(length)
 
 
+minCF = 1
+maxCF = 50
+@bot.command(
+  name="setCaptureFrameRate",
+  help="Change the frames per second captured for GIFs.\nMinimum is {}\nMaximum is {}".format(minCF, maxCF)
+)
+@commands.check(isConnectedToController)
+async def setCaptureFrameRate(ctx:commands.Context, fps:float) -> None:
+  # Find controller
+  controller = getControllerForMessageContext(ctx)
+  # Sanatize the number
+  fps = min(max(fps, minCF), maxCF)
+  await controller.setCaptureFrameRate(fps)
+
+
 minVL = 0
 maxVL = 10
 @bot.command(
@@ -341,14 +429,60 @@ async def setVotingPeriodLength(ctx:commands.Context, length:int) -> None:
   length = min(max(length, minVL), maxVL)
   await controller.setVotingPeriodLength(length)
 
+
+maxProfiledRounds = 10
+@bot.command(
+  name="profileRounds",
+  help="Profiles the next 'x' rounds of a controller, the channel's by default. 0 disarms.\nMaximum is {}".format(maxProfiledRounds)
+)
+@commands.is_owner()
+async def profileRounds(ctx:commands.Context, numberOfRounds:int=1,
+    controllerId:int=None) -> None:
+  # Find controller
+  if controllerId is None:
+    controller = getControllerForMessageContext(ctx)
+    if controller is None:
+      raise ChannelNotRegistered(ctx.message.channel)
+  else:
+    controller = ctx.bot.emulatorControllerGroup.findControllerById(controllerId)
+    if controller is None:
+      raise ControllerNotFoundByIdNumber(controllerId)
+  # Sanatize the number
+  numberOfRounds = min(max(numberOfRounds, 0), maxProfiledRounds)
+  controller.profileRounds(numberOfRounds)
+  await ctx.send("Profiling the next '{}' round(s) of controller '{}' to '{}'".format(
+    numberOfRounds,
+    controller.idNumber,
+    controller.profileDirectory
+  ))
+
+
+statsMessageLength = 1900
+@bot.command(
+  name="stats",
+  help="Sends a summary of the bot's metrics."
+)
+async def stats(ctx:commands.Context) -> None:
+  message = "\n".join(registry.summary())
+  if len(message) > statsMessageLength:
+    message = message[:statsMessageLength].rsplit("\n", 1)[0] + "\n..."
+  await ctx.send("```\n{}\n```".format(message))
+
     
 @bot.event
 async def close() -> None:
-  bot.emulatorControllerGroup.stopAll()
+  await bot.emulatorControllerGroup.closeAll()
+  if bot.metricsExporter is not None:
+    bot.metricsExporter.stop()
+    bot.metricsExporter = None
 
 
 @bot.event
 async def on_ready() -> None:
   # Set status
   await setStatusMessage()
+  # on_ready fires again on reconnects, export only once
+  if bot.metricsExporter is None and \
+      (metricsFilePath is not None or metricsPort is not None):
+    bot.metricsExporter = MetricsExporter(registry, metricsFilePath, metricsPort)
 
@@ -6,18 +6,65 @@ Discord Controller Settings
 :copyright: (c) 2019 i-question-this
 :license: GPL-3.0, see LICENSE for more details.
 """
-import datetime
+import asyncio
 import discord
+import hashlib
+import io
 import os
-import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import List
-from . import logger
-from .emulators.action import Action, ActionNotRecognized
-from .emulators.gameBoy import GameBoy
+from . import getLogger
+from .autosaver import Autosaver
+from .bootSnapshotCache import BootSnapshotCache
+from .emulators.capturePolicy import CapturePolicy
+from .emulators.clipOutput import ClipOutput
+from .emulators.emulator import AlreadyRunning
+from .emulators.emulatorHost import EmulatorHost
+from .emulators.inputSchedule import InputSchedule
+from .emulators.syntheticEmulator import SyntheticEmulator
 from .gamelibrary import ConsoleType, FileType
+from .metrics import registry
+from .romIndex import RomFile
+from .roundProfile import RoundProfile
+from .snapshotRing import SnapshotRing
 from .votingbox import VotingBox
 
+logger = getLogger("controller")
+
+# Metrics
+votesCast = registry.counter(
+  "discordplays_votes_total",
+  "Votes cast, including changed votes"
+)
+sendFailures = registry.counter(
+  "discordplays_send_failures_total",
+  "Messages that failed to send to a registered channel"
+)
+clipBytes = registry.counter(
+  "discordplays_clip_bytes_total",
+  "Bytes of clips sent, once per clip",
+  ("format",)
+)
+roundSeconds = registry.histogram(
+  "discordplays_round_seconds",
+  "Seconds from the end of voting to the clip being sent"
+)
+roundStageSeconds = registry.histogram(
+  "discordplays_round_stage_seconds",
+  "Seconds spent in each stage of a round",
+  ("stage",)
+)
+
+
+def _gameBoyClass():
+  # PyBoy is only needed once a Game Boy game is started
+  from .emulators.gameBoy import GameBoy
+  return GameBoy
+
+
+
 # Exceptions for this class
 class ChannelAlreadyRegistered(Exception):
   """Thrown when attempting to register an already registered channel"""
@@ -32,6 +79,10 @@ class ChannelNotRegistered(Exception):
     self.channel = channel
 
 
+class RoundInProgress(Exception):
+  """Thrown when attempting to rewind while a voting round is under way"""
+
+
 class SaveStateFileNotSpecified(Exception):
   """Thrown when attempting to save without a save-state file specified"""
 
@@ -44,6 +95,22 @@ class UnsupportedConsole(Exception):
 
 
 class EmulatorController:
+  # Uploads in flight at once for each controller
+  maxConcurrentSends = 5
+  # Largest attachment Discord accepts
+  clipSizeBudget = 8 * 1024 * 1024
+  # Rounds that can be rewound, and the memory their snapshots may take
+  maxSnapshots = 100
+  snapshotMemoryBudget = 32 * 1024 * 1024
+  # Autosave after this many rounds, or the first round this long after the
+  # last save, the game only moves during rounds
+  autosaveEveryRounds = 10
+  autosaveEverySeconds = 5 * 60
+  # Seconds a new game runs before its first clip
+  bootSeconds = 60
+  # Where profiled rounds are saved
+  profileDirectory = "profiles"
+
   # Buttons
   @property
   def buttonNames(self):
@@ -72,16 +139,47 @@ class EmulatorController:
     )
 
 
+  # Capturing
+  @property
+  def capturePolicy(self) -> CapturePolicy:
+    return self._capturePolicy
+
+
+  async def setCapturePolicy(self, newCapturePolicy:CapturePolicy) -> None:
+    self._capturePolicy = newCapturePolicy
+    if self._emulator is not None:
+      await self._runInWorker(
+        setattr,
+        self._emulator,
+        "capturePolicy",
+        newCapturePolicy
+      )
+
+
+  async def setCaptureFrameRate(self, newFps:float) -> None:
+    # Check value
+    if newFps <= 0:
+        raise ValueError("captureFrameRate must be greater than 0")
+    # Make change
+    await self.setCapturePolicy(CapturePolicy(targetFps=newFps))
+    # Inform users of the change
+    await self._sendMessageToRegisteredChannels(
+      "Set capture frame rate to '{}'".format(
+        newFps
+      )
+    )
+
+
   # Channels
   def deregisterChannel(self, channel:discord.abc.Messageable) -> None:
-    if not self._isChannelRegistered:
+    if not self.isChannelRegistered(channel):
       raise ChannelNotRegistered(channel)
 
-    self._registeredChannels.remove(channel)
+    del self._registeredChannels[channel.id]
 
 
   def isChannelRegistered(self, channel:discord.abc.Messageable) -> bool:
-    return channel in self._registeredChannels
+    return channel.id in self._registeredChannels
 
 
   @property
@@ -90,19 +188,21 @@ class EmulatorController:
 
 
   def registerChannel(self, channel:discord.abc.Messageable) -> None:
-    if self._isChannelRegistered:
+    if self.isChannelRegistered(channel):
       raise ChannelAlreadyRegistered(channel)
 
-    self._registeredChannels.append(channel)
+    self._registeredChannels[channel.id] = channel
 
   
   def registeredChannels(self) -> List[discord.abc.Messageable]:
-    return self._registeredChannels
+    return list(self._registeredChannels.values())
 
 
   # Consoles
+  # Console -> function returning its emulator class
   _supportedConsoles = {
-    ConsoleType.GB: GameBoy
+    ConsoleType.GB: _gameBoyClass,
+    ConsoleType.SYNTHETIC: lambda: SyntheticEmulator
   }
 
 
@@ -123,69 +223,284 @@ class EmulatorController:
 
 
   # Magic Methods
-  def __init__(self, idNumber, firstRegisteredChannel:discord.abc.Messageable):
+  def __init__(self, idNumber, firstRegisteredChannel:discord.abc.Messageable,
+      isolateEmulator:bool=False, bootSnapshots:BootSnapshotCache=None,
+      emulatorOptions:dict=None):
     # Channels
-    self._registeredChannels = [firstRegisteredChannel]
+    # Channel id -> channel, in the order they were registered
+    self._registeredChannels = {firstRegisteredChannel.id: firstRegisteredChannel}
+    self._sendLimit = None
+    self._roundLock = None
+    self._clipOutput = ClipOutput(self.clipSizeBudget)
 
     # Emulaator
     self._emulator = None
-    self._saveFilePath = None
+    self._isStarting = False
+    self._saveStateFilePath = None
     self._consoleType = None
+    self._isolateEmulator = isolateEmulator
+    self._bootSnapshots = bootSnapshots
+    # Console -> keyword arguments its emulators are made with
+    self._emulatorOptions = emulatorOptions if emulatorOptions is not None else {}
     self._numberOfSecondsAfterButtonPress = 10
+    self._snapshots = SnapshotRing(self.snapshotMemoryBudget, self.maxSnapshots)
+
+    # Capturing
+    # The boot only needs to show where the game ended up
+    self._capturePolicy = CapturePolicy(targetFps=20)
+    self._bootCapturePolicy = CapturePolicy(targetFps=20, lastSeconds=5)
     # Id Number
     self._idNumber = idNumber
 
     # Voting
     self._isVotingPeriod = True
-    self._isFirstVote = True
+    self._votingRound = None
     self._votingPeriodLength = 3
     self._votingBox = VotingBox()
 
+    # Saving
+    self._autosaver = Autosaver("{}-{}-autosave".format(
+      self.__class__.__name__,
+      idNumber
+    ))
+    self._roundsSinceSave = 0
+    self._lastSaveTime = time.monotonic()
+
+    # Profiling
+    self._roundsToProfile = 0
+    self._roundProfile = None
+
+    # Worker
+    # All emulator work runs here so the event loop is never blocked, and
+    # each controller emulates independently of every other controller.
+    self._worker = ThreadPoolExecutor(
+      max_workers=1,
+      thread_name_prefix="{}-{}".format(self.__class__.__name__, idNumber)
+    )
+
+
+  # Worker
+  async def _runInWorker(self, function, *args, **kwargs):
+    """Runs the function on this controller's worker and awaits the result
+    """
+    loop = asyncio.get_event_loop()
+    # Work of a profiled round is profiled on the worker too
+    if self._roundProfile is not None:
+      function = partial(self._roundProfile.call, function)
+    return await loop.run_in_executor(
+      self._worker,
+      partial(function, *args, **kwargs)
+    )
+
 
   # Messaging
-  async def _sendMessageToRegisteredChannels(self, text, file=None) -> None:
-    for channel in self._registeredChannels:
-      await channel.send(text, file=file)
+  async def _sendMessageToRegisteredChannels(self, text, fileData:bytes=None,
+      fileName:str=None) -> None:
+    """Sends to every registered channel at once, attaching fileData if given
+
+    A discord.File is consumed by its upload, so each channel gets its own
+    File over the shared, immutable fileData.
+    """
+    if self._sendLimit is None:
+      self._sendLimit = asyncio.Semaphore(self.maxConcurrentSends)
+
+    async def send(channel:discord.abc.Messageable) -> None:
+      async with self._sendLimit:
+        if fileData is not None:
+          await channel.send(
+            text,
+            file=discord.File(io.BytesIO(fileData), fileName)
+          )
+        else:
+          await channel.send(text)
+
+    channels = self.registeredChannels()
+    results = await asyncio.gather(
+      *(send(channel) for channel in channels),
+      return_exceptions=True
+    )
+    for channel, result in zip(channels, results):
+      if isinstance(result, Exception):
+        sendFailures.inc()
+        logger.error("%s: Failed to send to %s: %s",
+          self.__class__.__name__,
+          channel,
+          result
+        )
  
 
-  async def sendScreenShotGif(self) -> None:
-    # Create a unique file name
-    filePath = os.path.join(
-      tempfile.gettempdir(),
-       "{}--screenshot.gif".format(datetime.datetime.now())
+  def _makeClip(self):
+    """Finishes the clip and fits it to the upload limit, runs on the worker
+    """
+    clip = self._emulator.makeGIF()
+    logger.info("%s: Clip of %s bytes, %s frames captured, %s encoded, %s collapsed",
+      self.__class__.__name__,
+      len(clip.data),
+      clip.stats.framesCaptured,
+      clip.stats.framesEncoded,
+      clip.stats.framesCollapsed
     )
-    # Save the GIF
-    self._emulator.makeGIF(filePath)
-    logger.info("{}: Sending screenshot \"{}\"".format(
+    return self._clipOutput.fit(clip)
+
+
+  async def sendScreenShotGif(self) -> None:
+    # Finish the clip, it never leaves memory
+    with roundStageSeconds.time(stage="clip"):
+      clip = await self._runInWorker(self._makeClip)
+    logger.info("%s: Sending screenshot as %s of %s bytes",
       self.__class__.__name__,
-      filePath
-    ))
-    # Send the GIF to all regersted channels
-    await self._sendMessageToRegisteredChannels(
-      "",
-      file=discord.File(filePath, "screenshot.gif")
+      clip.format,
+      len(clip.data)
     )
-    # Delete the file since we are done with it
-    os.remove(filePath)
+    clipBytes.inc(len(clip.data), format=clip.format)
+    # Send the clip to all regersted channels
+    with roundStageSeconds.time(stage="upload"):
+      await self._sendMessageToRegisteredChannels(
+        "",
+        clip.data,
+        "screenshot.{}".format(clip.format)
+      )
 
 
   # Save action
-  def loadState(self):
+  async def loadState(self):
       self._emulator.assertIsRunning()
       if self.saveStateFilePath is not None:
-        self._emulator.loadState(self.saveStateFilePath)
+        # A save still being written must land before it is read
+        await self._flushSaves()
+        await self._runInWorker(self._emulator.loadState, self.saveStateFilePath)
       else:
         raise SaveStateFileNotSpecified()
 
 
-  def saveState(self):
+  async def saveState(self):
       self._emulator.assertIsRunning()
       if self.saveStateFilePath is not None:
-        self._emulator.saveState(self.saveStateFilePath)
+        await self._runInWorker(self._requestSave)
+        await self._flushSaves()
       else:
         raise SaveStateFileNotSpecified()
 
 
+  def _requestSave(self) -> None:
+    """Serializes the state in memory and queues it to be written to the
+    save state file, runs on the worker
+    """
+    if self.saveStateFilePath is None:
+      return
+    self._autosaver.request(
+      self.saveStateFilePath,
+      self._emulator.saveStateToBuffer()
+    )
+    self._roundsSinceSave = 0
+    self._lastSaveTime = time.monotonic()
+
+
+  def _autosaveIfDue(self) -> None:
+    """Queues a save every few rounds or minutes, runs on the worker"""
+    self._roundsSinceSave += 1
+    if self._roundsSinceSave >= self.autosaveEveryRounds or \
+        time.monotonic() - self._lastSaveTime >= self.autosaveEverySeconds:
+      self._requestSave()
+
+
+  async def _flushSaves(self) -> None:
+    """Waits for queued saves to be written, without blocking the loop"""
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, self._autosaver.flush)
+
+
+  # Rewinding
+  @property
+  def numberOfSnapshots(self) -> int:
+    """Number of rounds that can be rewound"""
+    return len(self._snapshots)
+
+
+  def _rewind(self, numberOfRounds:int) -> None:
+    """Restores the state from before the last numberOfRounds rounds, runs on
+    the worker so it lands between rounds
+    """
+    state = self._snapshots.rewind(numberOfRounds)
+    self._emulator.loadStateFromBuffer(state)
+    # Show where the game is now
+    self._emulator.runForXSeconds(1)
+
+
+  async def rewind(self, numberOfRounds:int) -> None:
+    self._emulator.assertIsRunning()
+    # A rewind landing between a round's vote and its clip takes over the clip
+    if self.isRoundInProgress:
+      raise RoundInProgress()
+    async with self._getRoundLock():
+      await self._runInWorker(self._rewind, numberOfRounds)
+      logger.info("%s: Rewound %s rounds, %s snapshots of %s bytes left",
+        self.__class__.__name__,
+        numberOfRounds,
+        len(self._snapshots),
+        self._snapshots.numberOfBytes
+      )
+      await self._sendMessageToRegisteredChannels(
+        "Rewound '{}' round(s)".format(numberOfRounds)
+      )
+      await self.sendScreenShotGif()
+
+
+  # Profiling
+  @property
+  def roundsToProfile(self) -> int:
+    return self._roundsToProfile
+
+
+  def profileRounds(self, numberOfRounds:int) -> None:
+    """Profiles the next numberOfRounds rounds, 0 disarms
+
+    Each round is saved to its own .pstats file in profileDirectory,
+    covering the emulation, capture, encoding and upload of the round. The
+    event loop part also holds anything else the loop ran meanwhile, see
+    RoundProfile.
+    """
+    if numberOfRounds < 0:
+      raise ValueError("numberOfRounds must be 0 or more")
+    self._roundsToProfile = numberOfRounds
+    logger.info("%s: Profiling the next %s rounds",
+      self.__class__.__name__,
+      numberOfRounds
+    )
+
+
+  async def _startRoundProfile(self) -> RoundProfile:
+    """The profile of the round about to be performed, None if disarmed"""
+    if self._roundsToProfile == 0:
+      return None
+    self._roundsToProfile -= 1
+    now = time.time()
+    profile = RoundProfile(os.path.join(
+      self.profileDirectory,
+      "controller-{}-{}.{:03d}.pstats".format(
+        self._idNumber,
+        time.strftime("%Y%m%d-%H%M%S", time.localtime(now)),
+        int(now * 1000) % 1000
+      )
+    ))
+    # The emulator hands it on to the clip encoder, and to its host process
+    await self._runInWorker(setattr, self._emulator, "profile", profile)
+    self._roundProfile = profile
+    return profile
+
+
+  async def _finishRoundProfile(self, profile:RoundProfile) -> None:
+    self._roundProfile = None
+    await self._runInWorker(setattr, self._emulator, "profile", None)
+    loop = asyncio.get_event_loop()
+    filePath = await loop.run_in_executor(None, profile.save)
+    logger.info("%s: Saved round profile to '%s', %s rounds left to profile",
+      self.__class__.__name__,
+      filePath,
+      self._roundsToProfile
+    )
+
+
   # SaveStateFilePath property
   @property
   def saveStateFilePath(self):
@@ -208,15 +523,37 @@ class EmulatorController:
 
 
   # Start
-  def start(self, consoleType:ConsoleType, gameROMPath:str,
-          bootROMPath:str, saveStateFilePath:str=None, newSaveStateFile:bool=False):
-    # Confirm there is not an already running emulator 
+  async def start(self, consoleType:ConsoleType, gameROM:RomFile,
+          bootROM:RomFile, saveStateFilePath:str=None, newSaveStateFile:bool=False):
+    # Confirm there is not an already running or booting emulator
+    if self._isStarting:
+      raise AlreadyRunning()
     if self._emulator is not None:
       self._emulator.assertNotRunning()
 
+    # Booting awaits the worker, a second start must not slip in meanwhile
+    self._isStarting = True
+    try:
+      await self._start(consoleType, gameROM, bootROM, saveStateFilePath,
+          newSaveStateFile)
+    finally:
+      self._isStarting = False
+
+
+  async def _start(self, consoleType:ConsoleType, gameROM:RomFile,
+          bootROM:RomFile, saveStateFilePath:str, newSaveStateFile:bool):
     # Confirm we support the choosen console type
     if consoleType in self.supportedConsoles():
-      self._emulator = self._supportedConsoles[consoleType]()
+      emulatorClass = self._supportedConsoles[consoleType]()
+      emulatorOptions = self._emulatorOptions.get(consoleType, {})
+      if self._isolateEmulator:
+        self._emulator = EmulatorHost(
+          emulatorClass,
+          emulatorOptions=emulatorOptions
+        )
+      else:
+        self._emulator = emulatorClass(**emulatorOptions)
+      self._emulator.capturePolicy = self._capturePolicy
       self._consoleType = consoleType
     else:
       raise UnsupportedConsole(consoleType)
@@ -224,55 +561,148 @@ class EmulatorController:
     # Is save file new?
     loadSaveStateFilePath = None if saveStateFilePath is not None and newSaveStateFile else saveStateFilePath
     # Start the specified game
-    self._emulator.start(gameROMPath, bootROMPath, loadSaveStateFilePath)
+    # Emulators open the file asked for, battery saves are kept next to it
+    bootROMPath = bootROM.path if bootROM is not None else None
+    if loadSaveStateFilePath is None:
+      await self._runInWorker(
+        self._boot,
+        gameROM.path,
+        bootROMPath,
+        (consoleType, gameROM.digest, bootROM.digest if bootROM is not None else None)
+      )
+    else:
+      await self._runInWorker(
+        self._emulator.start,
+        gameROM.path,
+        bootROMPath,
+        loadSaveStateFilePath,
+        self.bootSeconds,
+        capturePolicy=self._bootCapturePolicy
+      )
     # Record saveFilePath
     self.saveStateFilePath = saveStateFilePath
+    self._roundsSinceSave = 0
+    self._lastSaveTime = time.monotonic()
+    # Snapshots of another game can not be rewound to
+    self._snapshots.clear()
+
+
+  def _batterySaveDigest(self, gameROMPath:str) -> str:
+    """SHA-256 of the game's battery save, None if it has none
+
+    Save states carry the battery backed RAM, so a boot snapshot is only
+    good for the battery save it was booted with.
+    """
+    batterySavePath = self._emulator.batterySavePath(gameROMPath)
+    if batterySavePath is None or not os.path.exists(batterySavePath):
+      return None
+    with open(batterySavePath, "rb") as f:
+      return hashlib.sha256(f.read()).hexdigest()
+
+
+  def _boot(self, gameROMPath:str, bootROMPath:str, key:tuple) -> None:
+    """Boots a new game, from the boot snapshot cache if it has been booted
+    before, runs on the worker
+
+    Both ways end with the same clip, only the end of the boot is captured
+    and the snapshot is taken just before it.
+    """
+    clipSeconds = min(self._bootCapturePolicy.lastSeconds, self.bootSeconds)
+    key += (self._batterySaveDigest(gameROMPath),)
+    state = self._bootSnapshots.get(key) if self._bootSnapshots is not None else None
+    if state is None:
+      self._emulator.start(
+        gameROMPath,
+        bootROMPath,
+        None,
+        self.bootSeconds - clipSeconds,
+        CapturePolicy.none()
+      )
+      if self._bootSnapshots is not None:
+        self._bootSnapshots.put(key, self._emulator.saveStateToBuffer())
+    else:
+      self._emulator.start(gameROMPath, bootROMPath, None, 0)
+      self._emulator.loadStateFromBuffer(state)
+    logger.info("%s: Booted %s %s",
+      self.__class__.__name__,
+      key,
+      "cold" if state is None else "from snapshot"
+    )
+    self._emulator.runForXSeconds(clipSeconds, self._bootCapturePolicy)
 
 
   # Stop
-  def stop(self):
+  async def close(self) -> None:
+    """Stops the game and shuts the worker and autosaver down, for good"""
+    await self.stop()
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, self._worker.shutdown)
+    await loop.run_in_executor(None, self._autosaver.close)
+
+
+  async def stop(self):
     # Confirm there is actually something running
     if self._emulator is not None:
       if self._emulator.isRunning:
-        # Stop the emulator
-        self._emulator.stop(self.saveStateFilePath)
+        # Abandon any round in progress
+        if self._votingRound is not None:
+          self._votingRound.cancel()
+        # Save in the background, then stop the emulator
+        await self._runInWorker(self._requestSave)
+        await self._runInWorker(self._emulator.stop)
         # Reset the saveFilePath
-        self._saveFilePath = None
+        self._saveStateFilePath = None
+        self._snapshots.clear()
+        # The save must be on disk before the game can be started again
+        await self._flushSaves()
 
  
   # Voting
   def _castVote(self, author:discord.abc.User, button):
-    logger.info("{}: '{}' cast vote for '{}'".format(
+    logger.debug("%s: '%s' cast vote for '%s'",
       self.__class__.__name__,
       author,
       button
-    ))
-    self._votingBox.castVote(author, button)
+    )
+    self._votingBox.castVote(author.id, button)
+    votesCast.inc()
 
 
   @property
   def isVotingPeriod(self) -> bool:
     return self._isVotingPeriod
 
+
+  @property
+  def isRoundInProgress(self) -> bool:
+    """True from the first vote of a round until its clip is sent"""
+    return self._votingRound is not None
+
+
+  def _getRoundLock(self) -> asyncio.Lock:
+    """Held while a round or a rewind uses the emulator and its clip"""
+    if self._roundLock is None:
+      self._roundLock = asyncio.Lock()
+    return self._roundLock
+
   def _restartVoting(self) -> None:
       # Reset voting box
       self._votingBox = VotingBox()
-      # Reset isFirstVote
-      self._isFirstVote = True
+      # The next vote opens a new round
+      self._votingRound = None
       # Turning voting back on
       self._isVotingPeriod = True
-      logger.info("{}: Voting is starting".format(
+      logger.info("%s: Voting is starting",
         self.__class__.__name__
-      ))
+      )
 
   async def sendVotingResults(self, chosenButton) -> None:
     messageParts = ["Voting Results:"]
     messageParts.extend(self._votingBox.voteCounts())
     messageParts.append("Button Pressed: '{}'".format(chosenButton))
-    logger.info("{}: {}".format(
+    logger.info("%s: %s",
       self.__class__.__name__,
       ". ".join(messageParts))
-    )
     await self._sendMessageToRegisteredChannels("\n".join(messageParts))
 
 
@@ -290,47 +720,84 @@ class EmulatorController:
     )
 
 
-  async def voteForButton(self, vote, author:discord.abc.User) -> None:
-    # Quit if votes can not be cast at this time
-    if not self._isVotingPeriod:
-      return None
-    # Vote
-    if not self._isFirstVote:
-      self._castVote(author, vote)
-    else:
-      # Turn off isFirstVote
-      self.isFirstVote = False
-      logger.info("{}: User '{}' started voting period".format(
-        self.__class__.__name__,
-        author
-      ))
-      self._castVote(author, vote)
+  def _performVote(self, vote) -> None:
+    """Performs the winning vote on the emulator, runs on the worker
+    """
+    schedule = InputSchedule.fromVote(
+      vote,
+      self._emulator.fps,
+      self._numberOfSecondsAfterButtonPress
+    )
+    # Snapshot the round boundary so the vote can be undone
+    self._snapshots.push(self._emulator.saveStateToBuffer())
+    # Perform the button action(s), then run after them
+    self._emulator.runSchedule(schedule)
+    self._autosaveIfDue()
+
+
+  async def _playRound(self, resultVote) -> None:
+    """Announces, performs and shows the result of a round"""
+    with roundSeconds.time():
+      await self.sendVotingResults(resultVote)
+      with roundStageSeconds.time(stage="perform"):
+        await self._runInWorker(self._performVote, resultVote)
+      await self.sendScreenShotGif()
+
+
+  async def _runVotingRound(self) -> None:
+    """Closes the round after the voting period and performs the result
+
+    Runs as one task per round, so the round closes exactly once while
+    votes from every registered channel keep arriving in the meantime.
+    """
+    try:
       # Wait for voting period to end
-      time.sleep(self._votingPeriodLength)
+      await asyncio.sleep(self._votingPeriodLength)
       self._isVotingPeriod = False
-      logger.info("{}: Voting is over".format(
+      logger.info("%s: Voting is over",
         self.__class__.__name__
-      ))
+      )
       # Get the majority vote
       resultVote = self._votingBox.majorityVoteResult()
       if resultVote is not None:
-        await self.sendVotingResults(resultVote)
-        actionType, button, x = resultVote
-        # Perform the button action
-        if actionType == Action.PRESS: 
-            for _ in range(x):
-                self._emulator.pressButton(button)
-        elif actionType == Action.HOLD:
-            self._emulator.holdButton(button, x)
-        else:
-            self._restartVoting()
-            raise ActionNotRecognized(actionType)
-        # Run emulator after button press(s)
-        self._emulator.runForXSeconds(self._numberOfSecondsAfterButtonPress)
-        await self.sendScreenShotGif()
+        async with self._getRoundLock():
+          profile = await self._startRoundProfile()
+          if profile is None:
+            await self._playRound(resultVote)
+          else:
+            try:
+              # Also profiles whatever else the event loop runs meanwhile
+              with profile.thread():
+                await self._playRound(resultVote)
+            finally:
+              await self._finishRoundProfile(profile)
       else:
-        logger.critical("{}: No votes cast...somehow".format(
+        logger.critical("%s: No votes cast...somehow",
           self.__class__.__name__
-        ))
+        )
+    except asyncio.CancelledError:
+      logger.info("%s: Voting round cancelled",
+        self.__class__.__name__
+      )
+      raise
+    except Exception:
+      logger.exception("%s: Voting round failed",
+        self.__class__.__name__
+      )
+    finally:
       self._restartVoting()
 
+
+  async def voteForButton(self, vote, author:discord.abc.User) -> None:
+    # Quit if votes can not be cast at this time
+    if not self._isVotingPeriod:
+      return None
+    # Vote
+    self._castVote(author, vote)
+    # The first vote schedules the end of the round
+    if self._votingRound is None:
+      logger.info("%s: User '%s' started voting period",
+        self.__class__.__name__,
+        author
+      )
+      self._votingRound = asyncio.ensure_future(self._runVotingRound())
@@ -6,11 +6,15 @@ Emulator Controller Group
 :copyright: (c) 2019 i-question-this
 :license: GPL-3.0, see LICENSE for more details.
 """
+import asyncio
 import discord
-from . import logger
+from . import getLogger
+from .bootSnapshotCache import BootSnapshotCache
 from .emulatorController import ChannelAlreadyRegistered, ChannelNotRegistered, EmulatorController, UnsupportedConsole
 from .gamelibrary import ConsoleType
 
+logger = getLogger("controller")
+
 # Exceptions for this class
 class ControllerNotFoundByChannel(Exception):
   """Thrown when a controller is not found by channel"""
@@ -27,76 +31,102 @@ class ControllerNotFoundByIdNumber(Exception):
 
 
 class EmulatorControllerGroup:
+  """Every controller, indexed by id number and by each registered channel's
+  id, so finding the controller of a message never scans
+  """
+  # Memory for post boot snapshots, shared by every controller
+  bootSnapshotMemoryBudget = 64 * 1024 * 1024
+
   # Channels
   def _isChannelRegistered(self, channel:discord.abc.Messageable) -> bool:
-    for controller in self._emulatorControllers:
-      if controller.isChannelRegistered(channel):
-        return True
-    # If not found
-    return False
+    return channel.id in self._controllersByChannelId
+
+
+  def registerChannel(self, idNumber:int, channel:discord.abc.Messageable) -> None:
+    if self._isChannelRegistered(channel):
+      raise ChannelAlreadyRegistered(channel)
+    controller = self.findControllerById(idNumber)
+    if controller is None:
+      raise ControllerNotFoundByIdNumber(idNumber)
+
+    controller.registerChannel(channel)
+    self._controllersByChannelId[channel.id] = controller
+
+
+  def deregisterChannel(self, channel:discord.abc.Messageable) -> None:
+    controller = self.findControllerByChannel(channel)
+    if controller is None:
+      raise ChannelNotRegistered(channel)
+
+    controller.deregisterChannel(channel)
+    del self._controllersByChannelId[channel.id]
 
 
   # Controllers
   def createController(self, channel:discord.abc.Messageable) -> None:
     if self._isChannelRegistered(channel):
-      raise ChannelAlreadyRegistered(channel.guild.name, channel.name)
+      raise ChannelAlreadyRegistered(channel)
 
     # Start controller
     newController = EmulatorController(
       self._uniqueIdNumber(),
-      channel
+      channel,
+      self._isolateEmulators,
+      self._bootSnapshots,
+      emulatorOptions=self._emulatorOptions
     )
-    self._emulatorControllers.append(newController)
-    logger.info("{}: Created controller ID#{}".format(
+    self._controllersById[newController.idNumber] = newController
+    self._controllersByChannelId[channel.id] = newController
+    logger.info("%s: Created controller ID#%s",
       self.__class__.__name__,
       newController.idNumber
-    ))
+    )
 
 
-  def deleteController(self, idNumber:int) -> None:
-    controller = find(lambda controller: controller.idNumber == idNumber,
-                      self._emulatorControllers
-                     )
-    if controller is not None:
-      if controller.emulator.isRunning:
-        controller.emulator.stop()
-        self._emulatorControllers.remove(controller)
-        logger.info("{}: Deleted controller ID#{}".format(
-          self.__class__.__name__,
-          idNumber
-        ))
-    else:
+  async def deleteController(self, idNumber:int) -> None:
+    controller = self._controllersById.pop(idNumber, None)
+    if controller is None:
       raise ControllerNotFoundByIdNumber(idNumber)
 
+    for channel in controller.registeredChannels():
+      del self._controllersByChannelId[channel.id]
+    await controller.close()
+    logger.info("%s: Deleted controller ID#%s",
+      self.__class__.__name__,
+      idNumber
+    )
+
 
-  def findControllerByChannel(self, channel:discord.abc.Messageable) -> None:
-    for controller in self._emulatorControllers:
-      if controller.isChannelRegistered(channel):
-        return controller
-    return None
+  def findControllerByChannel(self, channel:discord.abc.Messageable) -> EmulatorController:
+    return self._controllersByChannelId.get(channel.id)
 
 
-  def findControllerById(self, idNumber:int) -> None:
-    for controller in self._emulatorControllers:
-      if controller.idNumber == idNumber:
-        return controller
-    return None
+  def findControllerById(self, idNumber:int) -> EmulatorController:
+    return self._controllersById.get(idNumber)
 
 
   @property
   def numberOfControllers(self) -> int:
-    return len(self._emulatorControllers)
+    return len(self._controllersById)
 
 
   @property
   def numberOfRunningEmulators(self) -> int:
-    return sum([1 if emCo.isRunning else 0 for emCo in self._emulatorControllers])
+    return sum([1 if emCo.isRunning else 0 for emCo in self._controllersById.values()])
 
 
-  def stopAll(self) -> None:
-    for controller in self._emulatorControllers:
-      if controller.isRunning:
-        controller.stop()
+  async def stopAll(self) -> None:
+    await asyncio.gather(*(
+      controller.stop() for controller in self._controllersById.values()
+      if controller.isRunning
+    ))
+
+
+  async def closeAll(self) -> None:
+    """Stops every game and closes every controller, for shutting down"""
+    await asyncio.gather(*(
+      controller.close() for controller in self._controllersById.values()
+    ))
 
 
   # Id Number
@@ -106,7 +136,10 @@ class EmulatorControllerGroup:
 
 
   # Magic Methods
-  def __init__(self):
-    self._emulatorControllers = []
+  def __init__(self, isolateEmulators:bool=False, emulatorOptions:dict=None):
+    self._controllersById = {}
+    self._controllersByChannelId = {}
+    self._isolateEmulators = isolateEmulators
+    self._emulatorOptions = emulatorOptions
+    self._bootSnapshots = BootSnapshotCache(self.bootSnapshotMemoryBudget)
     self.__previousIdNumber = -1
-
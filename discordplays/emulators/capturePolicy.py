@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""
+Which frames of a run end up in the clip
+~~~~~~~~~~~~~~~~~~~
+:copyright: (c) 2019 i-question-this
+:license: GPL-3.0, see LICENSE for more details.
+"""
+import math
+
+
+class CapturePolicy:
+  """Decides which frames of a run are captured
+
+  everyNthFrame and targetFps thin out the captured frames, targetFps wins
+  when both are given. lastSeconds only captures the end of each run. The
+  final frame of a run is always captured so clips end on what players
+  will vote on next.
+  """
+  # Magic Methods
+  def __init__(self, everyNthFrame:int=1, targetFps:float=None,
+      lastSeconds:float=None, enabled:bool=True):
+    if everyNthFrame < 1:
+      raise ValueError("everyNthFrame must be 1 or more")
+    if targetFps is not None and targetFps <= 0:
+      raise ValueError("targetFps must be greater than 0")
+    if lastSeconds is not None and lastSeconds < 0:
+      raise ValueError("lastSeconds must be 0 or more")
+
+    self._everyNthFrame = everyNthFrame
+    self._targetFps = targetFps
+    self._lastSeconds = lastSeconds
+    self._enabled = enabled
+
+
+  def __repr__(self) -> str:
+    return "{}(everyNthFrame={}, targetFps={}, lastSeconds={}, enabled={})".format(
+      self.__class__.__name__,
+      self._everyNthFrame,
+      self._targetFps,
+      self._lastSeconds,
+      self._enabled
+    )
+
+
+  @classmethod
+  def none(cls):
+    """Captures nothing, for boots and fast forwarding"""
+    return cls(enabled=False)
+
+
+  # Properties
+  @property
+  def enabled(self) -> bool:
+    return self._enabled
+
+
+  @property
+  def lastSeconds(self) -> float:
+    return self._lastSeconds
+
+
+  @property
+  def targetFps(self) -> float:
+    return self._targetFps
+
+
+  # Frames
+  def captureInterval(self, fps:float) -> int:
+    """Number of emulated frames per captured frame"""
+    if self._targetFps is not None:
+      return max(1, int(round(fps / self._targetFps)))
+    return self._everyNthFrame
+
+
+  def framesToCapture(self, numberOfFrames:int, fps:float) -> range:
+    """Indexes of the frames of a run of numberOfFrames to capture"""
+    if not self._enabled or numberOfFrames <= 0:
+      return range(0)
+
+    last = numberOfFrames - 1
+    first = 0
+    if self._lastSeconds is not None:
+      # Even the shortest end keeps the final frame
+      first = min(
+        max(0, numberOfFrames - int(math.ceil(self._lastSeconds * fps))),
+        last
+      )
+    interval = self.captureInterval(fps)
+    return range(first + (last - first) % interval, numberOfFrames, interval)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+"""
+Fits clips into an upload size budget
+~~~~~~~~~~~~~~~~~~~
+:copyright: (c) 2019 i-question-this
+:license: GPL-3.0, see LICENSE for more details.
+"""
+import io
+from PIL import features, Image, ImageSequence
+from typing import List, Tuple
+from .. import getLogger
+from .gifEncoder import Clip
+
+logger = getLogger("emulators")
+
+# Exceptions for this class
+class ClipTooBig(Exception):
+  """Thrown when not even the final frame of a clip fits in the budget"""
+  def __init__(self, numberOfBytes:int, budget:int):
+    self.numberOfBytes = numberOfBytes
+    self.budget = budget
+
+
+
+class ClipOutput:
+  """Picks the smallest encoding of a clip that fits in budget bytes
+
+  GIFs that fit are sent as they are, unless they are small enough, in
+  both frames and bytes, for trying animated WebP and APNG as well to be
+  cheap, since re-encoding costs several milliseconds a frame on the
+  worker. Clips that are too big are decoded again with fewer frames, then
+  a smaller size, until one of the formats fits. As a last resort the
+  final frame is sent on its own, as large as fits.
+  """
+  # (keep every Nth frame, scale) tried in order while the clip is too big
+  reductions = ((2, 1), (4, 1), (2, 0.5), (4, 0.5), (8, 0.5), (16, 0.25))
+
+  # Magic Methods
+  def __init__(self, budget:int, maxFramesToCompare:int=16,
+      maxBytesToCompare:int=64 * 1024):
+    if budget <= 0:
+      raise ValueError("budget must be greater than 0")
+
+    self._budget = budget
+    self._maxFramesToCompare = maxFramesToCompare
+    self._maxBytesToCompare = maxBytesToCompare
+    self._formats = ["gif", "png"]
+    if features.check("webp"):
+      self._formats.insert(1, "webp")
+
+
+  # Properties
+  @property
+  def budget(self) -> int:
+    return self._budget
+
+
+  # Fitting
+  def fit(self, clip:Clip) -> Clip:
+    if len(clip.data) <= self._budget:
+      if clip.stats.framesEncoded > self._maxFramesToCompare or \
+          len(clip.data) > self._maxBytesToCompare:
+        return clip
+      frames, durations = self._decode(clip.data, 1, 1)
+      return min(
+        self._candidates(clip, frames, durations, clip.format),
+        key=lambda candidate: len(candidate.data)
+      )
+
+    for everyNthFrame, scale in self.reductions:
+      frames, durations = self._decode(clip.data, everyNthFrame, scale)
+      fitting = [
+        candidate
+        for candidate in self._candidates(clip, frames, durations)
+        if len(candidate.data) <= self._budget
+      ]
+      if fitting:
+        logger.info("%s: Clip of %s bytes reduced to every %s frames at %s scale",
+          self.__class__.__name__,
+          len(clip.data),
+          everyNthFrame,
+          scale
+        )
+        return min(fitting, key=lambda candidate: len(candidate.data))
+
+    # Reductions skip frames, the final one is decoded by itself
+    lastFrame, lastDuration = self._decodeLast(clip.data)
+    for scale in sorted({scale for _, scale in self.reductions}, reverse=True):
+      frame = self._scale(lastFrame, scale)
+      fitting = [
+        candidate
+        for candidate in self._candidates(clip, [frame], [lastDuration])
+        if len(candidate.data) <= self._budget
+      ]
+      if fitting:
+        logger.warning("%s: Clip of %s bytes sent as its final frame at %s scale",
+          self.__class__.__name__,
+          len(clip.data),
+          scale
+        )
+        return min(fitting, key=lambda candidate: len(candidate.data))
+    raise ClipTooBig(len(clip.data), self._budget)
+
+
+  def _candidates(self, clip:Clip, frames:List[Image.Image],
+      durations:List[int], skipFormat:str=None) -> List[Clip]:
+    candidates = [] if skipFormat is None else [clip]
+    for clipFormat in self._formats:
+      if clipFormat != skipFormat:
+        candidates.append(clip._replace(
+          data=self._encode(frames, durations, clipFormat),
+          format=clipFormat
+        ))
+    return candidates
+
+
+  # Coding
+  @staticmethod
+  def _decode(data:bytes, everyNthFrame:int,
+      scale:float) -> Tuple[List[Image.Image], List[int]]:
+    """Decodes a GIF, keeping every Nth frame scaled by scale
+
+    Dropped frames lengthen the frame kept before them, so the clip plays
+    for as long as before.
+    """
+    frames = []
+    durations = []
+    with Image.open(io.BytesIO(data)) as gif:
+      for index, frame in enumerate(ImageSequence.Iterator(gif)):
+        duration = frame.info.get("duration", 0)
+        if index % everyNthFrame != 0:
+          durations[-1] += duration
+          continue
+        frames.append(ClipOutput._scale(frame.convert("RGB"), scale))
+        durations.append(duration)
+    return frames, durations
+
+
+  @staticmethod
+  def _scale(frame:Image.Image, scale:float) -> Image.Image:
+    if scale == 1:
+      return frame
+    return frame.resize(
+      (max(1, int(frame.width * scale)), max(1, int(frame.height * scale))),
+      Image.NEAREST
+    )
+
+
+  @staticmethod
+  def _decodeLast(data:bytes) -> Tuple[Image.Image, int]:
+    """Decodes only the final frame of a GIF, at full size"""
+    with Image.open(io.BytesIO(data)) as gif:
+      gif.seek(gif.n_frames - 1)
+      return gif.convert("RGB"), gif.info.get("duration", 0)
+
+
+  @staticmethod
+  def _encode(frames:List[Image.Image], durations:List[int],
+      clipFormat:str) -> bytes:
+    options = {"lossless": True} if clipFormat == "webp" else {}
+    output = io.BytesIO()
+    frames[0].save(
+      output,
+      format=clipFormat,
+      save_all=True,
+      append_images=frames[1:],
+      duration=durations,
+      loop=0,
+      **options
+    )
+    return output.getvalue()
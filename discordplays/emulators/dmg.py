@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+
+"""
+Colours of the original Game Boy screen
+~~~~~~~~~~~~~~~~~~~
+:copyright: (c) 2019 i-question-this
+:license: GPL-3.0, see LICENSE for more details.
+"""
+
+# Grey levels PyBoy draws the four DMG shades with, lightest first
+dmgShades = (0xFF, 0x99, 0x55, 0x00)
+# The shades as an RGB palette, for P mode frames of shade indexes
+dmgPalette = bytes(level for shade in dmgShades for level in (shade,) * 3)
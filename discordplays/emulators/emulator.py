@@ -8,11 +8,53 @@ Abstract contract of what a controller should do.
 :license: GPL-3.0, see LICENSE for more details.
 """
 from abc import ABC, abstractmethod
-from PIL import Image
-from typing import List
+from typing import BinaryIO, Callable, List, Tuple
 from .action import Action, Action
-from .. import logger
+from .capturePolicy import CapturePolicy
+from .frameRing import FrameRing
+from .gifEncoder import Clip, GIFEncoder
+from .inputSchedule import InputSchedule
+from .. import getLogger
+from ..autosaver import writeAtomically
+from ..metrics import registry
+import cProfile
+import io
 import math
+import time
+
+logger = getLogger("emulators")
+
+# Metrics
+framesEmulated = registry.counter(
+  "discordplays_frames_emulated_total",
+  "Frames emulated",
+  ("emulator",)
+)
+emulationSeconds = registry.counter(
+  "discordplays_emulation_seconds_total",
+  "Seconds spent emulating, frames per second is the ratio of the two",
+  ("emulator",)
+)
+captureWaitSeconds = registry.counter(
+  "discordplays_capture_wait_seconds_total",
+  "Seconds emulation waited for the clip encoder to free a frame slot",
+  ("emulator",)
+)
+clipFinishSeconds = registry.histogram(
+  "discordplays_clip_finish_seconds",
+  "Seconds makeGIF waited for the encoder to finish a clip",
+  ("emulator",)
+)
+clipEncodeSeconds = registry.counter(
+  "discordplays_clip_encode_seconds_total",
+  "Seconds the clip encoder thread spent encoding frames",
+  ("emulator",)
+)
+clipFrames = registry.counter(
+  "discordplays_clip_frames_total",
+  "Frames captured for clips, by what became of them, outcomes add up to the frames captured",
+  ("emulator", "outcome")
+)
 
 # Exceptions for this class
 class AlreadyRunning(Exception):
@@ -66,20 +108,14 @@ class ButtonCode:
 class Emulator(ABC):
   """Represents how a controller should behave"""
   # Buttons  
-  __buttons = {}
-
   @property
   def buttonNames(self) -> List[str]:
     return [buttonName.lower() for buttonName in self.__buttons.keys()]
 
 
   @abstractmethod
-  def _abstractHoldButton(self, button:ButtonCode, numberOfSeconds:float) -> None:
-    pass
-
-
-  @abstractmethod
-  def _abstractPressButton(self, button:ButtonCode) -> None:
+  def _abstractSendInput(self, button:ButtonCode, isPress:bool) -> None:
+    """Presses or releases the button, taking effect from the next frame"""
     pass
 
 
@@ -87,36 +123,27 @@ class Emulator(ABC):
     try:
       return self.__buttons[buttonName.lower()]
     except KeyError:
-      logger.critical("{}: Unrecognized button \"{}\"".format(
+      logger.critical("%s: Unrecognized button \"%s\"",
         self.__class__.__name__,
         buttonName
-      ))
-      raise ButtonNotReconized(buttonName)
+      )
+      raise ButtonNotRecognized(buttonName)
 
 
   def holdButton(self, buttonName:str, numberOfSeconds:float) -> None:
-    self.assertIsRunning()
+    """Holds the button for numberOfSeconds, then runs for a second"""
     if numberOfSeconds < 0:
         raise ValueError("numberOfSeconds must be greater than 0")
-    button = self._getButton(buttonName)
-
-    logger.info("{}: Holding button {} for {} seconds".format(
-      self.__class__.__name__,
-      button.name,
-      numberOfSeconds
+    self.runSchedule(InputSchedule().hold(
+      buttonName,
+      max(1, int(math.ceil(numberOfSeconds * self._fps))),
+      self._fps
     ))
-    self._abstractHoldButton(button, numberOfSeconds)
 
 
   def pressButton(self, buttonName:str) -> None:
-    self.assertIsRunning()
-    button = self._getButton(buttonName)
-
-    logger.info("{}: Pressing button {}".format(
-      self.__class__.__name__,
-      button.name
-    ))
-    self._abstractPressButton(button)
+    """Presses the button, then runs for a second"""
+    self.runSchedule(InputSchedule().press(buttonName, self._fps))
 
 
   def _registerButton(self, button:ButtonCode) -> None:
@@ -124,19 +151,121 @@ class Emulator(ABC):
 
   
   # Magic Methods
-  def __init__(self, fps:int=60):
+  def __init__(self, fps:int=60, frameRingCapacity:int=64):
     # Save information
+    self.__buttons = {}
     self._fps = fps
-    self.__screenShots = [] 
+    self._frameRingCapacity = frameRingCapacity
+    self.__frameRing = None
+    self.__clip = None
+    self.__clipBuffer = None
+    self.__screenShotSink = None
+    self._capturePolicy = CapturePolicy()
+    self._profile = None
+    self.__processProfile = None
+
+
+  # Profiling
+  @property
+  def profile(self):
+    """RoundProfile that clip encoders profile into, or None"""
+    return self._profile
+
+
+  @profile.setter
+  def profile(self, newProfile) -> None:
+    self._profile = newProfile
+
+
+  def _startProcessProfile(self) -> None:
+    """Profiles the calling thread until _stopProcessProfile
+
+    Used by hosts to profile the thread their emulator runs on.
+    """
+    self.__processProfile = cProfile.Profile()
+    self.__processProfile.enable()
+
+
+  def _stopProcessProfile(self) -> dict:
+    """Stats profiled since _startProcessProfile"""
+    profile = self.__processProfile
+    if profile is None:
+      return {}
+    self.__processProfile = None
+    profile.disable()
+    profile.create_stats()
+    return profile.stats
+
+
+  # Capturing
+  @property
+  def capturePolicy(self) -> CapturePolicy:
+    """Policy used by runs that do not specify their own"""
+    return self._capturePolicy
+
+
+  @capturePolicy.setter
+  def capturePolicy(self, newCapturePolicy:CapturePolicy) -> None:
+    self._capturePolicy = newCapturePolicy
 
 
   # Running
+  @property
+  def fps(self) -> int:
+    return self._fps
+
+
   @abstractmethod
   def _runForOneFrame(self) -> None:
     pass
 
 
-  def runForXFrames(self, numberOfFrames:int) -> None:
+  def _abstractRunFrames(self, numberOfFrames:int, render:bool) -> None:
+    """Advances numberOfFrames frames
+
+    render is False when none of the frames will be captured, emulators
+    that can skip drawing the screen should do so.
+    """
+    for _ in range(numberOfFrames):
+      self._runForOneFrame()
+
+
+  def runFrames(self, numberOfFrames:int, captureEvery:int=0,
+      firstCapture:int=None) -> None:
+    """Advances numberOfFrames frames, capturing every captureEvery-th
+
+    Captures start at firstCapture, by default lined up so the final frame
+    is captured. A captureEvery of 0 captures nothing. Frames in between
+    captures run in batches without being rendered.
+    """
+    if numberOfFrames < 0:
+      raise ValueError("numberOfFrames must 0 or more")
+    if captureEvery < 0:
+      raise ValueError("captureEvery must 0 or more")
+
+    self.assertIsRunning()
+
+    if captureEvery == 0:
+      framesToCapture = range(0)
+    else:
+      if firstCapture is None:
+        firstCapture = (numberOfFrames - 1) % captureEvery
+      framesToCapture = range(firstCapture, numberOfFrames, captureEvery)
+    duration = 1000 * captureEvery / self._fps
+
+    framesRun = 0
+    for frame in framesToCapture:
+      if frame > framesRun:
+        self._abstractRunFrames(frame - framesRun, False)
+      self._abstractRunFrames(1, True)
+      self._takeScreenShot(duration)
+      framesRun = frame + 1
+    if framesRun < numberOfFrames:
+      self._abstractRunFrames(numberOfFrames - framesRun, False)
+
+
+  def runForXFrames(self, numberOfFrames:int,
+      capturePolicy:CapturePolicy=None) -> None:
     if numberOfFrames < 0:
       raise ValueError("numberOfFrames must 0 or more")
 
@@ -145,68 +274,258 @@ class Emulator(ABC):
     if numberOfFrames == 0:
       return
 
-    logger.info("{}: Running for {} frames, aka {} seconds".format(
+    logger.debug("%s: Running for %s frames, aka %s seconds",
       self.__class__.__name__, 
       numberOfFrames, 
       numberOfFrames / self._fps
-    ))
+    )
+
+    if capturePolicy is None:
+      capturePolicy = self._capturePolicy
+    framesToCapture = capturePolicy.framesToCapture(numberOfFrames, self._fps)
+    start = time.perf_counter()
+    waitStart = self._captureWaitSeconds()
+    if len(framesToCapture) == 0:
+      self.runFrames(numberOfFrames)
+    else:
+      self.runFrames(numberOfFrames, framesToCapture.step, framesToCapture.start)
+    self._recordFrames(
+      numberOfFrames,
+      time.perf_counter() - start,
+      self._captureWaitSeconds() - waitStart
+    )
+
+
+  def runSchedule(self, schedule:InputSchedule,
+      capturePolicy:CapturePolicy=None) -> None:
+    """Runs every frame of the schedule, sending its inputs on the way
+
+    Captures are spread over the whole schedule, and frames in between
+    events and captures run in batches.
+    """
+    self.assertIsRunning()
+    # Unknown buttons fail before anything runs
+    buttons = {
+      event.buttonName: self._getButton(event.buttonName)
+      for event in schedule
+    }
 
-    for _ in range(numberOfFrames):
-      self._runForOneFrame()
-      self._takeScreenShot()
+    logger.debug("%s: Running schedule of %s inputs over %s frames",
+      self.__class__.__name__,
+      len(schedule),
+      schedule.numberOfFrames
+    )
+
+    if capturePolicy is None:
+      capturePolicy = self._capturePolicy
+    framesToCapture = capturePolicy.framesToCapture(
+      schedule.numberOfFrames,
+      self._fps
+    )
+
+    start = time.perf_counter()
+    waitStart = self._captureWaitSeconds()
+    framesRun = 0
+    for frame, events in schedule.batches():
+      self._runScheduledFrames(framesRun, frame, framesToCapture)
+      framesRun = frame
+      for event in events:
+        self._abstractSendInput(buttons[event.buttonName], event.isPress)
+    self._runScheduledFrames(framesRun, schedule.numberOfFrames, framesToCapture)
+    self._recordFrames(
+      schedule.numberOfFrames,
+      time.perf_counter() - start,
+      self._captureWaitSeconds() - waitStart
+    )
 
 
-  def runForXSeconds(self, numberOfSeconds:int) -> None:
+  @property
+  def emulatorName(self) -> str:
+    """Name metrics of this emulator are labelled with"""
+    return self.__class__.__name__
+
+
+  def _captureWaitSeconds(self) -> float:
+    """Seconds captures have waited for a free ring slot so far"""
+    if self.__frameRing is None:
+      return 0
+    return self.__frameRing.writeWaitSeconds
+
+
+  def _recordFrames(self, numberOfFrames:int, seconds:float,
+      waitSeconds:float=0) -> None:
+    """Records frames run in seconds, waitSeconds of which were spent
+    waiting on the clip encoder rather than emulating
+    """
+    framesEmulated.inc(numberOfFrames, emulator=self.emulatorName)
+    emulationSeconds.inc(seconds - waitSeconds, emulator=self.emulatorName)
+    captureWaitSeconds.inc(waitSeconds, emulator=self.emulatorName)
+
+
+  def _runScheduledFrames(self, start:int, end:int,
+      framesToCapture:range) -> None:
+    """Runs frames start to end of a schedule, capturing framesToCapture"""
+    if end <= start:
+      return
+    if len(framesToCapture) == 0:
+      self.runFrames(end - start)
+      return
+    step = framesToCapture.step
+    # First capture at or after start, relative to start
+    first = max(start, framesToCapture.start)
+    first += (framesToCapture.start - first) % step
+    self.runFrames(end - start, step, first - start)
+
+
+  def runForXSeconds(self, numberOfSeconds:int,
+      capturePolicy:CapturePolicy=None) -> None:
     if numberOfSeconds < 0:
       raise ValueError("numberOfSeconds must 0 or more")
 
     self.assertIsRunning()
 
     numFrames = int(math.ceil(numberOfSeconds * self._fps))
-    self.runForXFrames(numFrames)
+    self.runForXFrames(numFrames, capturePolicy)
 
 
   # Screenshots
   @abstractmethod
-  def _abstractTakeScreenShot(self) -> Image:
+  def _abstractScreenBuffer(self):
+    """Raw pixels of the screen, laid out as screenShotMode"""
     pass
 
 
-  def makeGIF(self, filePath) -> Image:
+  @property
+  @abstractmethod
+  def screenShotMode(self) -> str:
+    """PIL mode of the screen buffer"""
+    pass
+
+
+  @property
+  @abstractmethod
+  def screenShotSize(self) -> Tuple[int, int]:
+    pass
+
+
+  @property
+  def screenShotPalette(self) -> bytes:
+    """Fixed RGB palette of P mode screen buffers, otherwise None"""
+    return None
+
+
+  def makeGIF(self, filePath:str=None) -> Clip:
+    """Finishes the clip in progress, also writing it to filePath if given
+    """
     self.assertIsRunning()
 
-    if len(self.__screenShots) == 0:
+    if self.__clip is None:
       raise NoScreenShotFramesSaved()
 
-    logger.info("{}: Creating screenshot GIF".format(
+    logger.debug("%s: Creating screenshot GIF",
       self.__class__.__name__
-    ))
-    
-    self.__screenShots[0].save(
-      filePath,
-      format='GIF',
-      loop=0, save_all=True,
-      append_images=self.__screenShots[1:],
-      duration=int(round(len(self.__screenShots) / self._fps)))
-    
-    # Reset values
-    self.__screenShots = [] 
-
-    
-  def _takeScreenShot(self) -> None:
+    )
+
+    try:
+      # The frames are already encoded, only the tail is left to write
+      with clipFinishSeconds.time(emulator=self.emulatorName):
+        stats = self.__clip.finish()
+      # Frames too short to be shown are dropped
+      outcomes = {
+        "encoded": stats.framesEncoded,
+        "collapsed": stats.framesCollapsed,
+        "dropped": stats.framesCaptured - stats.framesEncoded - stats.framesCollapsed
+      }
+      for outcome, numberOfFrames in outcomes.items():
+        clipFrames.inc(numberOfFrames, emulator=self.emulatorName,
+            outcome=outcome)
+      clipEncodeSeconds.inc(stats.encodeSeconds, emulator=self.emulatorName)
+      if stats.framesEncoded == 0:
+        raise NoScreenShotFramesSaved()
+      clip = Clip(self.__clipBuffer.getvalue(), stats, "gif")
+      if filePath is not None:
+        with open(filePath, "wb") as f:
+          f.write(clip.data)
+      return clip
+    finally:
+      # Reset values
+      self.__clip = None
+      self.__clipBuffer = None
+
+
+  def _discardClip(self) -> None:
+    """Drops the clip in progress along with the frame ring"""
+    if self.__clip is not None:
+      try:
+        self.__clip.finish()
+      except Exception:
+        logger.exception("%s: Discarded clip failed to encode",
+          self.__class__.__name__
+        )
+    self.__clip = None
+    self.__clipBuffer = None
+    self.__frameRing = None
+
+
+  def _startClip(self) -> None:
+    """Starts encoding whatever arrives in the frame ring into a new clip"""
+    if self.__clip is None and self.__frameRing is not None:
+      self.__clipBuffer = io.BytesIO()
+      self.__clip = GIFEncoder(
+        self.__clipBuffer,
+        self.__frameRing,
+        self.screenShotMode,
+        self.screenShotSize,
+        self.screenShotPalette,
+        profile=self._profile
+      )
+
+
+  def _useFrameRing(self, frameRing:FrameRing) -> None:
+    """Encodes clips from a ring written by someone else"""
+    self.__frameRing = frameRing
+
+
+  def _takeScreenShot(self, duration:float) -> None:
+    """Captures the screen, to be shown for duration milliseconds"""
     self.assertIsRunning()
-    self.__screenShots.append(self._abstractTakeScreenShot())
+    screenBuffer = self._abstractScreenBuffer()
+    if self.__screenShotSink is not None:
+      self.__screenShotSink(screenBuffer, duration)
+      return
+    # Frames wait in a fixed size ring until the encoder picks them up
+    if self.__frameRing is None:
+      self.__frameRing = FrameRing.allocate(
+        memoryview(screenBuffer).nbytes,
+        self._frameRingCapacity
+      )
+    self._startClip()
+    self.__frameRing.write(screenBuffer, duration)
+
+
+  def redirectScreenShots(self, sink:Callable[[bytes, float], None]) -> None:
+    """Hands every raw screen buffer to sink instead of encoding it
+    """
+    self.__screenShotSink = sink
 
 
 
   # Starting
+  @classmethod
+  def batterySavePath(cls, gameROMPath:str) -> str:
+    """File the game's battery backed RAM is kept in, None if there is none
+    """
+    return None
+
+
   @abstractmethod
   def _abstractStart(self, gameROMPath:str, bootROMPath:str=None) -> None:
     pass
   
 
   def start(self, gameROMPath:str, bootROMPath:str=None,
-      saveStateFilePath:str=None, numberOfSecondsToRun:int=60) -> None:
+      saveStateFilePath:str=None, numberOfSecondsToRun:int=60,
+      capturePolicy:CapturePolicy=None) -> None:
     if numberOfSecondsToRun < 0:
       raise ValueError("numberOfSecondsToRun must be 0 or more")
 
@@ -217,7 +536,7 @@ class Emulator(ABC):
     if saveStateFilePath is not None:
         self.loadState(saveStateFilePath)
 
-    self.runForXSeconds(numberOfSecondsToRun)
+    self.runForXSeconds(numberOfSecondsToRun, capturePolicy)
 
 
   # Stopping 
@@ -232,33 +551,58 @@ class Emulator(ABC):
     if saveStateFilePath is not None:
         self.saveState(saveStateFilePath)
     self._abstractStop()
+    self._discardClip()
 
 
   # State Management
   @abstractmethod
-  def saveState(self, saveStateFilePath:str) -> None:
-      pass
+  def _abstractSaveState(self, file:BinaryIO) -> None:
+    pass
 
 
   @abstractmethod
+  def _abstractLoadState(self, file:BinaryIO) -> None:
+    pass
+
+
+  def saveState(self, saveStateFilePath:str) -> None:
+    # Never leave a half written save behind
+    writeAtomically(saveStateFilePath, self.saveStateToBuffer())
+
+
   def loadState(self, saveStateFilePath:str) -> None:
-      pass
+    with open(saveStateFilePath, "rb") as f:
+      self._abstractLoadState(f)
+
+
+  def saveStateToBuffer(self) -> bytes:
+    """Save state as bytes, without touching the disk"""
+    self.assertIsRunning()
+    buffer = io.BytesIO()
+    self._abstractSaveState(buffer)
+    return buffer.getvalue()
+
+
+  def loadStateFromBuffer(self, state:bytes) -> None:
+    """Loads a save state made by saveStateToBuffer"""
+    self.assertIsRunning()
+    self._abstractLoadState(io.BytesIO(state))
 
 
   # Status
   def assertIsRunning(self) -> None:
     if not self.isRunning:
-      logger.critical("{}: Emulator is not running".format(
+      logger.critical("%s: Emulator is not running",
         self.__class__.__name__
-      ))
+      )
       raise NotRunning()
 
 
   def assertNotRunning(self) -> None:
     if self.isRunning:
-      logger.critical("{}: Emulator is already running".format(
+      logger.critical("%s: Emulator is already running",
         self.__class__.__name__
-      ))
+      )
       raise AlreadyRunning()
 
 
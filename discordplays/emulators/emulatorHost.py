@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+
+"""
+Runs an emulator in its own process
+~~~~~~~~~~~~~~~~~~~
+:copyright: (c) 2019 i-question-this
+:license: GPL-3.0, see LICENSE for more details.
+"""
+import multiprocessing
+import time
+from typing import BinaryIO, List, Tuple
+from .. import getLogger
+from .capturePolicy import CapturePolicy
+from .emulator import ButtonCode, Emulator
+from .frameRing import FrameRing
+from .inputSchedule import InputSchedule
+
+logger = getLogger("emulators")
+
+# Exceptions for this class
+class EmulatorHostDied(Exception):
+  """Thrown when the process hosting an emulator exits unexpectedly"""
+  def __init__(self, exitCode:int):
+    self.exitCode = exitCode
+
+
+
+def _hostMain(emulatorClass, emulatorOptions:dict, connection, freeSlots,
+    filledSlots, ringCapacity:int) -> None:
+  """Entry point of the host process
+
+  Executes (methodName, args, kwargs) requests on the emulator until a
+  methodName of None arrives. Screen buffers are written to a shared memory
+  ring which is announced to the parent before the first frame.
+  """
+  emulator = emulatorClass(**emulatorOptions)
+  ring = None
+
+  def sendToRing(screenBuffer, duration:float) -> None:
+    nonlocal ring
+    if ring is None:
+      ring = FrameRing.create(
+        memoryview(screenBuffer).nbytes,
+        ringCapacity,
+        freeSlots,
+        filledSlots
+      )
+      connection.send(("frames", ring.name, ring.frameSize,
+          emulator.screenShotMode, emulator.screenShotSize,
+          emulator.screenShotPalette))
+    ring.write(screenBuffer, duration)
+
+  emulator.redirectScreenShots(sendToRing)
+
+  try:
+    while True:
+      methodName, args, kwargs = connection.recv()
+      if methodName is None:
+        break
+      try:
+        result = getattr(emulator, methodName)(*args, **kwargs)
+      except Exception as e:
+        connection.send(("error", e))
+      else:
+        # The parent cannot see how long the host waited on the ring
+        connection.send(("result", result,
+            ring.writeWaitSeconds if ring is not None else 0))
+  finally:
+    if ring is not None:
+      ring.close()
+      ring.unlink()
+
+
+
+class EmulatorHost(Emulator):
+  """Runs emulatorClass in a child process behind the Emulator interface
+
+  Each host has its own interpreter, so emulators do not compete for the
+  GIL. Frames come back through a shared memory ring instead of being
+  pickled, and are encoded in this process straight from that ring.
+  emulatorOptions are keyword arguments the hosted emulator is made with.
+  """
+  # Buttons
+  @property
+  def buttonNames(self) -> List[str]:
+    return self._buttonNames
+
+
+  def _abstractSendInput(self, button:ButtonCode, isPress:bool) -> None:
+    self._call("_abstractSendInput", button, isPress)
+
+
+  def holdButton(self, buttonName:str, numberOfSeconds:float) -> None:
+    self.assertIsRunning()
+    self._call("holdButton", buttonName, numberOfSeconds)
+
+
+  def pressButton(self, buttonName:str) -> None:
+    self.assertIsRunning()
+    self._call("pressButton", buttonName)
+
+
+  # Magic Methods
+  def __init__(self, emulatorClass, ringCapacity:int=120,
+      pollInterval:float=0.005, emulatorOptions:dict=None):
+    if emulatorOptions is None:
+      emulatorOptions = {}
+    template = emulatorClass(**emulatorOptions)
+    super().__init__(template._fps)
+
+    self._emulatorClass = emulatorClass
+    self._emulatorOptions = emulatorOptions
+    self._buttonNames = template.buttonNames
+    self._ringCapacity = ringCapacity
+    self._pollInterval = pollInterval
+
+    self._context = multiprocessing.get_context("spawn")
+    self._process = None
+    self._connection = None
+    self._freeSlots = None
+    self._filledSlots = None
+    self._ring = None
+    self._screenShotMode = None
+    self._screenShotSize = None
+    self._screenShotPalette = None
+    self._hostWaitSeconds = 0
+
+
+  # Capturing
+  @property
+  def capturePolicy(self) -> CapturePolicy:
+    return self._capturePolicy
+
+
+  @capturePolicy.setter
+  def capturePolicy(self, newCapturePolicy:CapturePolicy) -> None:
+    self._capturePolicy = newCapturePolicy
+    if self.isRunning:
+      self._call("__setattr__", "capturePolicy", newCapturePolicy)
+
+
+  # Profiling
+  @property
+  def profile(self):
+    return self._profile
+
+
+  @profile.setter
+  def profile(self, newProfile) -> None:
+    # Cleared first, the call below starts the next clip without it
+    previousProfile = self._profile
+    self._profile = newProfile
+    if not self.isRunning:
+      return
+    if previousProfile is not None:
+      previousProfile.addStats(self._call("_stopProcessProfile"))
+    if newProfile is not None:
+      self._call("_startProcessProfile")
+
+
+  # Process
+  def _call(self, methodName:str, *args, **kwargs):
+    """Runs methodName on the hosted emulator while frames are encoded
+    """
+    # The host waits for ring slots, so something must be reading them
+    self._startClip()
+    self._connection.send((methodName, args, kwargs))
+    while True:
+      if not self._connection.poll(self._pollInterval):
+        if not self._process.is_alive():
+          raise EmulatorHostDied(self._process.exitcode)
+        continue
+
+      kind, *payload = self._connection.recv()
+      if kind == "frames":
+        name, frameSize, self._screenShotMode, self._screenShotSize, \
+            self._screenShotPalette = payload
+        self._ring = FrameRing.attach(
+          name,
+          frameSize,
+          self._ringCapacity,
+          self._freeSlots,
+          self._filledSlots
+        )
+        self._useFrameRing(self._ring)
+        self._startClip()
+      elif kind == "error":
+        raise payload[0]
+      else:
+        result, self._hostWaitSeconds = payload
+        return result
+
+
+  def _startProcess(self) -> None:
+    self._hostWaitSeconds = 0
+    self._freeSlots = self._context.Semaphore(self._ringCapacity)
+    self._filledSlots = self._context.Semaphore(0)
+    self._connection, childConnection = self._context.Pipe()
+    self._process = self._context.Process(
+      target=_hostMain,
+      args=(
+        self._emulatorClass,
+        self._emulatorOptions,
+        childConnection,
+        self._freeSlots,
+        self._filledSlots,
+        self._ringCapacity
+      ),
+      daemon=True
+    )
+    self._process.start()
+    childConnection.close()
+    logger.info("%s: Started host process %s for %s",
+      self.__class__.__name__,
+      self._process.pid,
+      self._emulatorClass.__name__
+    )
+
+
+  def _stopProcess(self) -> None:
+    # Stop reading the ring before it goes away
+    self._discardClip()
+    try:
+      self._connection.send((None, (), {}))
+    except (BrokenPipeError, EOFError):
+      pass
+    self._process.join()
+    logger.info("%s: Host process %s exited with %s",
+      self.__class__.__name__,
+      self._process.pid,
+      self._process.exitcode
+    )
+    if self._ring is not None:
+      self._ring.close()
+    self._connection.close()
+    self._process = None
+    self._connection = None
+    self._ring = None
+
+
+  # Running
+  def _runForOneFrame(self) -> None:
+    self._call("_runForOneFrame")
+
+
+  def runFrames(self, numberOfFrames:int, captureEvery:int=0,
+      firstCapture:int=None) -> None:
+    self.assertIsRunning()
+    self._call("runFrames", numberOfFrames, captureEvery, firstCapture)
+
+
+  def runForXFrames(self, numberOfFrames:int,
+      capturePolicy:CapturePolicy=None) -> None:
+    self.assertIsRunning()
+    start = time.perf_counter()
+    waitStart = self._captureWaitSeconds()
+    self._call("runForXFrames", numberOfFrames, capturePolicy)
+    self._recordFrames(
+      numberOfFrames,
+      time.perf_counter() - start,
+      self._captureWaitSeconds() - waitStart
+    )
+
+
+  def runSchedule(self, schedule:InputSchedule,
+      capturePolicy:CapturePolicy=None) -> None:
+    # The whole schedule runs in the host, one round trip per vote
+    self.assertIsRunning()
+    start = time.perf_counter()
+    waitStart = self._captureWaitSeconds()
+    self._call("runSchedule", schedule, capturePolicy)
+    self._recordFrames(
+      schedule.numberOfFrames,
+      time.perf_counter() - start,
+      self._captureWaitSeconds() - waitStart
+    )
+
+
+  def _captureWaitSeconds(self) -> float:
+    # The ring is written in the host, which reports its waits with results
+    return self._hostWaitSeconds
+
+
+  @property
+  def emulatorName(self) -> str:
+    return self._emulatorClass.__name__
+
+
+  # Screenshots
+  def _abstractScreenBuffer(self):
+    return self._call("_abstractScreenBuffer")
+
+
+  @property
+  def screenShotMode(self) -> str:
+    return self._screenShotMode
+
+
+  @property
+  def screenShotSize(self) -> Tuple[int, int]:
+    return self._screenShotSize
+
+
+  @property
+  def screenShotPalette(self) -> bytes:
+    return self._screenShotPalette
+
+
+  # Starting
+  def batterySavePath(self, gameROMPath:str) -> str:
+    return self._emulatorClass.batterySavePath(gameROMPath)
+
+
+  def _abstractStart(self, gameROMPath:str, bootROMPath:str=None) -> None:
+    self._call("_abstractStart", gameROMPath, bootROMPath)
+
+
+  def start(self, gameROMPath:str, bootROMPath:str=None,
+      saveStateFilePath:str=None, numberOfSecondsToRun:int=60,
+      capturePolicy:CapturePolicy=None) -> None:
+    self.assertNotRunning()
+    self._startProcess()
+    try:
+      self._call("__setattr__", "capturePolicy", self._capturePolicy)
+      self._call("start", gameROMPath, bootROMPath, saveStateFilePath,
+          numberOfSecondsToRun, capturePolicy)
+    except Exception:
+      self._stopProcess()
+      raise
+
+
+  # Stopping
+  def _abstractStop(self) -> None:
+    self._call("_abstractStop")
+
+
+  def stop(self, saveStateFilePath:str=None) -> None:
+    self.assertIsRunning()
+    try:
+      self._call("stop", saveStateFilePath)
+    finally:
+      self._stopProcess()
+
+
+  # State Management
+  def _abstractLoadState(self, file:BinaryIO) -> None:
+    self._call("loadStateFromBuffer", file.read())
+
+
+  def _abstractSaveState(self, file:BinaryIO) -> None:
+    file.write(self._call("saveStateToBuffer"))
+
+
+  def loadStateFromBuffer(self, state:bytes) -> None:
+    self.assertIsRunning()
+    self._call("loadStateFromBuffer", state)
+
+
+  def saveStateToBuffer(self) -> bytes:
+    self.assertIsRunning()
+    return self._call("saveStateToBuffer")
+
+
+  # Status
+  @property
+  def isRunning(self) -> bool:
+    return self._process is not None
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+"""
+Ring buffer of raw frames
+~~~~~~~~~~~~~~~~~~~
+:copyright: (c) 2019 i-question-this
+:license: GPL-3.0, see LICENSE for more details.
+"""
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+
+class FrameRing:
+  """Fixed capacity ring of equally sized raw frames
+
+  There is one writer and one reader. The writer waits on freeSlots when
+  every slot is full and the reader waits on filledSlots when every slot is
+  empty, so both semaphores must be shareable between them. Every slot
+  also records how long its frame is shown, in milliseconds.
+  """
+  _duration = struct.Struct("d")
+
+  # Magic Methods
+  def __init__(self, buffer, frameSize:int, capacity:int, freeSlots,
+      filledSlots, sharedMemory:shared_memory.SharedMemory=None):
+    if frameSize <= 0:
+      raise ValueError("frameSize must be greater than 0")
+    if capacity <= 0:
+      raise ValueError("capacity must be greater than 0")
+    if len(buffer) < self.bufferSize(frameSize, capacity):
+      raise ValueError("buffer is too small for {} frames of {} bytes".format(
+        capacity,
+        frameSize
+      ))
+
+    self._buffer = memoryview(buffer)
+    self._frameSize = frameSize
+    self._slotSize = self._duration.size + frameSize
+    self._capacity = capacity
+    self._freeSlots = freeSlots
+    self._filledSlots = filledSlots
+    self._sharedMemory = sharedMemory
+    self._readIndex = 0
+    self._writeIndex = 0
+    # Seconds the writer spent waiting for the reader to free a slot
+    self._writeWaitSeconds = 0
+    # Wake ups posted to the reader, counted on the reader's side
+    self._wakeUps = 0
+    self._wakeUpLock = threading.Lock()
+
+
+  @classmethod
+  def bufferSize(cls, frameSize:int, capacity:int) -> int:
+    """Bytes needed to hold capacity frames of frameSize bytes"""
+    return (cls._duration.size + frameSize) * capacity
+
+
+  @classmethod
+  def allocate(cls, frameSize:int, capacity:int):
+    """Creates a ring for a writer and reader in the same process"""
+    return cls(
+      bytearray(cls.bufferSize(frameSize, capacity)),
+      frameSize,
+      capacity,
+      threading.Semaphore(capacity),
+      threading.Semaphore(0)
+    )
+
+
+  # Shared Memory
+  @classmethod
+  def create(cls, frameSize:int, capacity:int, freeSlots, filledSlots):
+    """Creates a ring backed by a new shared memory block"""
+    sharedMemory = shared_memory.SharedMemory(
+      create=True,
+      size=cls.bufferSize(frameSize, capacity)
+    )
+    return cls(sharedMemory.buf, frameSize, capacity, freeSlots,
+        filledSlots, sharedMemory)
+
+
+  @classmethod
+  def attach(cls, name:str, frameSize:int, capacity:int, freeSlots,
+      filledSlots):
+    """Attaches to a ring previously made by create in another process"""
+    sharedMemory = shared_memory.SharedMemory(name=name)
+    return cls(sharedMemory.buf, frameSize, capacity, freeSlots,
+        filledSlots, sharedMemory)
+
+
+  @property
+  def name(self) -> str:
+    return self._sharedMemory.name if self._sharedMemory is not None else None
+
+
+  def close(self) -> None:
+    self._buffer.release()
+    if self._sharedMemory is not None:
+      self._sharedMemory.close()
+
+
+  def unlink(self) -> None:
+    if self._sharedMemory is not None:
+      self._sharedMemory.unlink()
+
+
+  # Frames
+  @property
+  def capacity(self) -> int:
+    return self._capacity
+
+
+  @property
+  def frameSize(self) -> int:
+    return self._frameSize
+
+
+  @property
+  def writeWaitSeconds(self) -> float:
+    """Seconds write has waited for a free slot so far"""
+    return self._writeWaitSeconds
+
+
+  def read(self, timeout:float=None):
+    """Returns the oldest (frame, duration), or None if none arrived in time
+    """
+    if not self._filledSlots.acquire(True, timeout):
+      return None
+    # Slot counts are interchangeable, a frame taking a wake up's place is
+    # read by the next read instead
+    with self._wakeUpLock:
+      if self._wakeUps > 0:
+        self._wakeUps -= 1
+        return None
+    offset = (self._readIndex % self._capacity) * self._slotSize
+    duration, = self._duration.unpack_from(self._buffer, offset)
+    offset += self._duration.size
+    frame = bytes(self._buffer[offset:offset + self._frameSize])
+    self._readIndex += 1
+    self._freeSlots.release()
+    return frame, duration
+
+
+  def wakeReader(self) -> None:
+    """Makes a waiting, or the next, read return None straight away
+
+    Must be called from the reader's process.
+    """
+    with self._wakeUpLock:
+      self._wakeUps += 1
+    self._filledSlots.release()
+
+
+  def write(self, frame, duration:float=0) -> None:
+    """Copies the frame into the next slot, waiting for one to be free"""
+    frame = memoryview(frame).cast("B")
+    if len(frame) != self._frameSize:
+      raise ValueError("frame is {} bytes, expected {}".format(
+        len(frame),
+        self._frameSize
+      ))
+    if not self._freeSlots.acquire(False):
+      start = time.perf_counter()
+      self._freeSlots.acquire()
+      self._writeWaitSeconds += time.perf_counter() - start
+    offset = (self._writeIndex % self._capacity) * self._slotSize
+    self._duration.pack_into(self._buffer, offset, duration)
+    offset += self._duration.size
+    self._buffer[offset:offset + self._frameSize] = frame
+    self._writeIndex += 1
+    self._filledSlots.release()
@@ -7,35 +7,25 @@ Controller Interface For PyBoy
 :license: GPL-3.0, see LICENSE for more details.
 """
 import os
-from PIL import Image
 from pyboy import windowevent
 from pyboy import PyBoy
-from .. import logger
+from typing import BinaryIO, Tuple
+from .dmg import dmgPalette, dmgShades
 from .emulator import ButtonCode, Emulator
 
 
-class GameBoy(Emulator):
-  # Buttons
-  def _abstractHoldButton(self, button:ButtonCode, numberOfSeconds:float) -> None:
-    """Holds the specified button for the specififed time
-    """
-    logger.info("PyBoy: Pressing button: {}".format(button.name))
-    self._pyboy.sendInput(button.pressCode)
-    self.runForXSeconds(numberOfSeconds)
-    logger.info("PyBoy: Releasing button: {}".format(button.name))
-    self._pyboy.sendInput(button.releaseCode)
-    self.runForXSeconds(1)
+# Shade index closest to every grey level
+_dmgShadeIndexes = bytes(
+  min(range(len(dmgShades)), key=lambda i: abs(dmgShades[i] - level))
+  for level in range(256)
+)
 
 
-  def _abstractPressButton(self, button:ButtonCode) -> None:
-    """Presses the specified button
-    """
-    logger.info("PyBoy: Pressing button: {}".format(button.name))
-    self._pyboy.sendInput(button.pressCode)
-    self.runForXFrames(2)
-    logger.info("PyBoy: Releasing button: {}".format(button.name))
-    self._pyboy.sendInput(button.releaseCode)
-    self.runForXSeconds(1)
+
+class GameBoy(Emulator):
+  # Buttons
+  def _abstractSendInput(self, button:ButtonCode, isPress:bool) -> None:
+    self._pyboy.sendInput(button.pressCode if isPress else button.releaseCode)
     
 
   # Magic methods
@@ -45,6 +35,9 @@ class GameBoy(Emulator):
     self._pyboy = None
     self._screenWidth = 160
     self._screenHeight = 144
+    self._screenBufferStride = None
+    self._canSkipRendering = False
+    self._isRendering = True
 
     # Button registration
     self._registerButton(
@@ -110,21 +103,55 @@ class GameBoy(Emulator):
     self._pyboy.tick()
 
 
+  def _abstractRunFrames(self, numberOfFrames:int, render:bool) -> None:
+    # Not every PyBoy release can turn the renderer off
+    if self._canSkipRendering and render != self._isRendering:
+      self._pyboy.disableRenderer(not render)
+      self._isRendering = render
+    tick = self._pyboy.tick
+    for _ in range(numberOfFrames):
+      tick()
+
+
   # Screenshots
-  def _abstractTakeScreenShot(self) -> Image:
-    """Takes screen shot of emulator
+  def _abstractScreenBuffer(self):
+    """Screen buffer of emulator as one shade index per pixel
+
+    Every channel of a DMG pixel holds the same grey level, so one channel
+    is picked out and translated, all in C, with no quantizing needed.
     """
-    return Image.frombytes(
-      self._pyboy.getScreenBufferFormat(),
-      (self._screenWidth, self._screenHeight),
-      self._pyboy.getScreenBuffer()
-    )
+    screenBuffer = self._pyboy.getScreenBuffer()
+    return screenBuffer[::self._screenBufferStride].translate(_dmgShadeIndexes)
+
+
+  @property
+  def screenShotMode(self) -> str:
+    return "P"
+
+
+  @property
+  def screenShotPalette(self) -> bytes:
+    return dmgPalette
+
+
+  @property
+  def screenShotSize(self) -> Tuple[int, int]:
+    return (self._screenWidth, self._screenHeight)
 
 
   # Starting
+  @classmethod
+  def batterySavePath(cls, gameROMPath:str) -> str:
+    # PyBoy loads and saves cartridge RAM next to the ROM
+    return gameROMPath + ".ram"
+
+
   def _abstractStart(self, gameROM, bootROM):
     self._pyboy = PyBoy(None, 3, gameROM, bootROM)
     self._pyboy.setEmulationSpeed(False)
+    self._screenBufferStride = len(self._pyboy.getScreenBufferFormat())
+    self._canSkipRendering = hasattr(self._pyboy, "disableRenderer")
+    self._isRendering = True
 
 
   # Stopping
@@ -134,12 +161,14 @@ class GameBoy(Emulator):
 
 
   # State Management
-  def loadState(self, saveStateFilePath:str) -> None:
-      self._pyboy.loadState(saveStateFilePath)
+  # PyBoy only saves to paths, its motherboard saves to any file
+  def _abstractLoadState(self, file:BinaryIO) -> None:
+    self._pyboy.mb.loadState(file)
+
 
+  def _abstractSaveState(self, file:BinaryIO) -> None:
+    self._pyboy.mb.saveState(file)
 
-  def saveState(self, saveStateFilePath:str) -> None:
-      self._pyboy.saveState(saveStateFilePath)
 
   # Status
   @property
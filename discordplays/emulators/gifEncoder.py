@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""
+Streaming GIF encoder
+~~~~~~~~~~~~~~~~~~~
+:copyright: (c) 2019 i-question-this
+:license: GPL-3.0, see LICENSE for more details.
+"""
+import threading
+import time
+from collections import namedtuple
+from PIL import GifImagePlugin, Image
+from typing import BinaryIO, Tuple
+from .frameRing import FrameRing
+
+ClipStats = namedtuple(
+  'ClipStats',
+  'framesCaptured framesEncoded framesCollapsed encodeSeconds'
+)
+
+Clip = namedtuple('Clip', 'data stats format')
+
+
+
+class GIFEncoder:
+  """Writes a looping GIF to output one frame at a time
+
+  A background thread reads raw frames from a FrameRing and writes each
+  one as soon as it is encoded. Images only exist while a frame is being
+  encoded, and the emulator keeps producing while the encoder works.
+  Given a RoundProfile, the encoding thread profiles itself into it.
+  """
+  # Browsers show delays below 2/100 of a second as 1/10 of a second
+  minimumDelay = 20
+
+  # Magic Methods
+  def __init__(self, output:BinaryIO, frameRing:FrameRing, mode:str,
+      size:Tuple[int, int], palette:bytes=None, pollInterval:float=0.05,
+      profile=None):
+    if palette is not None and mode != "P":
+      raise ValueError("A palette requires P mode frames, not {}".format(mode))
+
+    self._output = output
+    self._frameRing = frameRing
+    self._mode = mode
+    self._size = size
+    self._palette = palette
+    self._pollInterval = pollInterval
+    self._profile = profile
+    self._error = None
+    self._isFinishing = False
+    self._numberOfFrames = 0
+    self._numberOfFramesRead = 0
+    self._numberOfCollapsedFrames = 0
+    # Time the thread spent encoding, waits for frames left out
+    self._encodeSeconds = 0
+
+    # Time line, in milliseconds
+    self._elapsed = 0
+    self._pending = None
+    self._pendingStart = 0
+
+    self._thread = threading.Thread(
+      target=self._run,
+      name=self.__class__.__name__,
+      daemon=True
+    )
+    self._thread.start()
+
+
+  # Frames
+  @property
+  def stats(self) -> ClipStats:
+    """Frame counts of the clip, final once finished"""
+    return ClipStats(
+      self._numberOfFramesRead,
+      self._numberOfFrames,
+      self._numberOfCollapsedFrames,
+      self._encodeSeconds
+    )
+
+
+  def finish(self) -> ClipStats:
+    """Encodes what is left in the ring and writes the trailer
+
+    Must only be called once the writer has stopped adding frames.
+    """
+    if not self._isFinishing:
+      self._isFinishing = True
+      # Do not wait for the poll to time out
+      self._frameRing.wakeReader()
+      self._thread.join()
+    if self._error is not None:
+      raise self._error
+    return self.stats
+
+
+  # Encoding
+  def _run(self) -> None:
+    if self._profile is None:
+      self._encodeFrames()
+    else:
+      self._profile.call(self._encodeFrames)
+
+
+  def _encodeFrames(self) -> None:
+    while True:
+      # Once finishing no more frames arrive, what is left is read at once
+      item = self._frameRing.read(
+        0 if self._isFinishing else self._pollInterval
+      )
+      if item is None:
+        if not self._isFinishing:
+          continue
+        # Frames may have landed between the read and the check
+        item = self._frameRing.read(0)
+        if item is None:
+          break
+      # Keep draining after an error so the writer never waits forever
+      if self._error is not None:
+        continue
+      start = time.perf_counter()
+      try:
+        self._encodeFrame(*item)
+      except Exception as e:
+        self._error = e
+      self._encodeSeconds += time.perf_counter() - start
+
+    if self._error is None:
+      start = time.perf_counter()
+      try:
+        self._flush(self._elapsed)
+        if self._numberOfFrames > 0:
+          self._output.write(b";")
+      except Exception as e:
+        self._error = e
+      self._encodeSeconds += time.perf_counter() - start
+
+
+  def _encodeFrame(self, frame:bytes, duration:float) -> None:
+    self._numberOfFramesRead += 1
+    if frame == self._pending:
+      # Identical frames just extend how long the pending one is shown
+      self._numberOfCollapsedFrames += 1
+    elif self._pending is None or \
+        self._elapsed - self._pendingStart >= self.minimumDelay:
+      self._flush(self._elapsed)
+      self._pending = frame
+      self._pendingStart = self._elapsed
+    else:
+      # The pending frame would be too short to display, it is dropped in
+      # favour of the newer one so clips end on the latest screen
+      self._pending = frame
+    self._elapsed += duration
+
+
+  def _flush(self, end:float) -> None:
+    """Writes the pending frame, shown until end"""
+    if self._pending is None:
+      return
+    frame = Image.frombytes(self._mode, self._size, self._pending)
+    self._pending = None
+    if self._palette is not None:
+      # Every frame shares the global palette
+      frame.putpalette(self._palette)
+    else:
+      if frame.mode != "RGB":
+        frame = frame.convert("RGB")
+      frame = frame.quantize()
+    # Rounding the start and end keeps the total play time accurate
+    delay = 10 * (int(round(end / 10)) - int(round(self._pendingStart / 10)))
+
+    if self._numberOfFrames == 0:
+      header, _ = GifImagePlugin.getheader(frame, info={"loop": 0})
+      for block in header:
+        self._output.write(block)
+    for block in GifImagePlugin.getdata(frame, duration=delay,
+        include_color_table=self._palette is None):
+      self._output.write(block)
+    self._numberOfFrames += 1
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""
+Frame indexed schedule of button presses and releases
+~~~~~~~~~~~~~~~~~~~
+:copyright: (c) 2019 i-question-this
+:license: GPL-3.0, see LICENSE for more details.
+"""
+import math
+from collections import namedtuple
+from typing import Iterable, Iterator, Tuple
+from .action import Action, ActionNotRecognized
+
+InputEvent = namedtuple('InputEvent', 'frame buttonName isPress')
+
+
+
+class InputSchedule:
+  """Presses and releases to send at given frames of a run
+
+  A schedule is plain data, so it can be built ahead of time, compared,
+  pickled to another process or kept to replay a round. The run lasts
+  numberOfFrames frames, events are sent just before their frame runs, or
+  after the last frame for events at numberOfFrames.
+  """
+  # Frames a pressed button is held down for
+  framesPerPress = 2
+
+  # Magic Methods
+  def __init__(self, events:Iterable[InputEvent]=(), numberOfFrames:int=0):
+    self._events = sorted(
+      (InputEvent(*event) for event in events),
+      key=lambda event: event.frame
+    )
+    if self._events and self._events[0].frame < 0:
+      raise ValueError("Events can not be before frame 0")
+    if numberOfFrames < 0:
+      raise ValueError("numberOfFrames must 0 or more")
+    self._numberOfFrames = max(
+      [numberOfFrames] + [event.frame for event in self._events]
+    )
+
+
+  def __eq__(self, other) -> bool:
+    if not isinstance(other, InputSchedule):
+      return NotImplemented
+    return self._events == other._events and \
+        self._numberOfFrames == other._numberOfFrames
+
+
+  def __iter__(self) -> Iterator[InputEvent]:
+    return iter(self._events)
+
+
+  def __len__(self) -> int:
+    return len(self._events)
+
+
+  def __repr__(self) -> str:
+    return "{}({!r}, numberOfFrames={})".format(
+      self.__class__.__name__,
+      self._events,
+      self._numberOfFrames
+    )
+
+
+  # Properties
+  @property
+  def numberOfFrames(self) -> int:
+    return self._numberOfFrames
+
+
+  def batches(self) -> Iterator[Tuple[int, Tuple[InputEvent, ...]]]:
+    """Every frame with events, along with the events sent at it"""
+    index = 0
+    while index < len(self._events):
+      frame = self._events[index].frame
+      end = index
+      while end < len(self._events) and self._events[end].frame == frame:
+        end += 1
+      yield frame, tuple(self._events[index:end])
+      index = end
+
+
+  # Building
+  def hold(self, buttonName:str, numberOfFrames:int,
+      framesAfter:int=0) -> "InputSchedule":
+    """Holds a button down from the end of the schedule, then waits"""
+    if numberOfFrames < 1:
+      raise ValueError("numberOfFrames must be 1 or more")
+    start = self._numberOfFrames
+    self._events.append(InputEvent(start, buttonName, True))
+    self._events.append(InputEvent(start + numberOfFrames, buttonName, False))
+    self._numberOfFrames = start + numberOfFrames + framesAfter
+    return self
+
+
+  def press(self, buttonName:str, framesAfter:int=0) -> "InputSchedule":
+    return self.hold(buttonName, self.framesPerPress, framesAfter)
+
+
+  def wait(self, numberOfFrames:int) -> "InputSchedule":
+    if numberOfFrames < 0:
+      raise ValueError("numberOfFrames must 0 or more")
+    self._numberOfFrames += numberOfFrames
+    return self
+
+
+  @classmethod
+  def fromVote(cls, vote:tuple, fps:int, secondsAfter:float) -> "InputSchedule":
+    """Schedule of a voted (action, button, x), then secondsAfter seconds
+
+    Presses are followed by a second each, like a hold once it is released.
+    """
+    actionType, buttonName, x = vote
+    schedule = cls()
+    if actionType == Action.PRESS:
+      for _ in range(x):
+        schedule.press(buttonName, fps)
+    elif actionType == Action.HOLD:
+      schedule.hold(buttonName, int(math.ceil(x * fps)), fps)
+    else:
+      raise ActionNotRecognized(actionType)
+    return schedule.wait(int(math.ceil(secondsAfter * fps)))
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+"""
+Synthetic emulator for load and scale testing
+~~~~~~~~~~~~~~~~~~~
+:copyright: (c) 2019 i-question-this
+:license: GPL-3.0, see LICENSE for more details.
+"""
+import hashlib
+import random
+import struct
+import time
+from typing import BinaryIO, Tuple
+from .. import getLogger
+from .dmg import dmgPalette, dmgShades
+from .emulator import ButtonCode, Emulator
+
+logger = getLogger("emulators")
+
+
+class SyntheticEmulator(Emulator):
+  """Emulates nothing, but behaves like an emulator to everything around it
+
+  Frames are four shade 160x144 patterns that depend only on the ROM path,
+  the frame number and the buttons pressed, so runs are reproducible.
+  Every frame burns frameCost seconds of CPU and save states are
+  saveStateSize bytes, both tunable for capacity planning without PyBoy
+  or ROMs. The rest of a save state is pseudo-random bytes seeded by the
+  header, so it compresses about as badly as a real one.
+  """
+  # Save states start with the frame number and scene
+  _stateHeader = struct.Struct("<QQ")
+
+  # Buttons
+  def _abstractSendInput(self, button:ButtonCode, isPress:bool) -> None:
+    # Every press moves on to another scene
+    if isPress:
+      self._scene += button.pressCode
+
+
+  # Magic Methods
+  def __init__(self, frameCost:float=0, saveStateSize:int=16 * 1024,
+      framesPerScene:int=30, numberOfScenes:int=8):
+    super().__init__(60)
+    if frameCost < 0:
+      raise ValueError("frameCost must be 0 or more")
+    if saveStateSize < self._stateHeader.size:
+      raise ValueError("saveStateSize must be at least {}".format(
+        self._stateHeader.size
+      ))
+
+    self._frameCost = frameCost
+    self._saveStateSize = saveStateSize
+    self._framesPerScene = framesPerScene
+    self._numberOfScenes = numberOfScenes
+    self._screenWidth = 160
+    self._screenHeight = 144
+
+    self._isRunning = False
+    self._frame = 0
+    self._scene = 0
+    self._scenes = []
+
+    for code, name in enumerate(("A", "B", "Select", "Start", "Up", "Down",
+        "Left", "Right"), 1):
+      self._registerButton(ButtonCode(name, code))
+
+
+  # Running
+  def _runForOneFrame(self) -> None:
+    if self._frameCost > 0:
+      deadline = time.perf_counter() + self._frameCost
+      while time.perf_counter() < deadline:
+        pass
+    self._frame += 1
+
+
+  # Screenshots
+  def _abstractScreenBuffer(self):
+    scene = self._frame // self._framesPerScene + self._scene
+    return self._scenes[scene % self._numberOfScenes]
+
+
+  @property
+  def screenShotMode(self) -> str:
+    return "P"
+
+
+  @property
+  def screenShotPalette(self) -> bytes:
+    return dmgPalette
+
+
+  @property
+  def screenShotSize(self) -> Tuple[int, int]:
+    return (self._screenWidth, self._screenHeight)
+
+
+  # Starting
+  def _abstractStart(self, gameROMPath:str, bootROMPath:str=None) -> None:
+    seed = hashlib.sha256(str(gameROMPath).encode()).digest()
+    self._scenes = [
+      bytes(
+        (x // 8 + y // 8 + seed[scene % len(seed)] + scene) % len(dmgShades)
+        for y in range(self._screenHeight)
+        for x in range(self._screenWidth)
+      )
+      for scene in range(self._numberOfScenes)
+    ]
+    self._frame = 0
+    self._scene = 0
+    self._isRunning = True
+    logger.info("%s: Started synthetic game '%s'",
+      self.__class__.__name__,
+      gameROMPath
+    )
+
+
+  # Stopping
+  def _abstractStop(self) -> None:
+    self._isRunning = False
+    self._scenes = []
+
+
+  # State Management
+  def _abstractLoadState(self, file:BinaryIO) -> None:
+    self._frame, self._scene = self._stateHeader.unpack(
+      file.read(self._stateHeader.size)
+    )
+
+
+  def _abstractSaveState(self, file:BinaryIO) -> None:
+    file.write(self._stateHeader.pack(self._frame, self._scene))
+    padding = random.Random((self._frame << 64) | self._scene)
+    file.write(padding.randbytes(self._saveStateSize - self._stateHeader.size))
+
+
+  # Status
+  @property
+  def isRunning(self) -> bool:
+    return self._isRunning
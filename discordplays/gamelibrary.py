@@ -7,8 +7,11 @@ Game library class
 :license: GPL-3.0, see LICENSE for more details.
 """
 import os
+import time
+from collections import namedtuple
 from enum import auto, Enum, unique
-from typing import List
+from typing import Dict, List, Optional
+from .romIndex import RomFile, RomIndex
 
 class EnumFromString(Enum):
   @classmethod
@@ -28,6 +31,8 @@ class ConsoleType(EnumFromString):
   GB="gb"
   GBC="gbc"
   NES="nes"
+  # Generated frames for load testing, ROM files are only used as seeds
+  SYNTHETIC="synthetic"
 
 
 
@@ -50,8 +55,51 @@ class FileNotFound(Exception):
 
 
 
+RomHeader = namedtuple(
+  'RomHeader',
+  'title cgbFlag cartridgeType headerChecksum isHeaderChecksumValid'
+)
+
+LibraryFile = namedtuple('LibraryFile', 'name path size modified header')
+
+
+def parseGameBoyHeader(data:bytes) -> Optional[RomHeader]:
+  """Reads the cartridge header of a Game Boy ROM, None if it is too short
+  """
+  if len(data) < 0x150:
+    return None
+  # The last byte of the title is the CGB flag on colour cartridges
+  cgbFlag = data[0x143]
+  titleEnd = 0x143 if cgbFlag & 0x80 else 0x144
+  title = data[0x134:titleEnd].split(b"\0", 1)[0]
+  # Checksum over the bytes from the title up to the checksum itself
+  checksum = 0
+  for byte in data[0x134:0x14D]:
+    checksum = (checksum - byte - 1) & 0xFF
+  return RomHeader(
+    title.decode("ascii", "replace").strip(),
+    cgbFlag,
+    data[0x147],
+    data[0x14D],
+    checksum == data[0x14D]
+  )
+
+
+
 class GameLibrary():
-  """Provides easy access to ROM library"""
+  """Provides easy access to ROM library
+
+  Every directory is indexed in memory, along with the cartridge headers of
+  games, when the library is made. A directory is read again only once its
+  modification time changes, which happens whenever files are added,
+  removed or renamed in it.
+  """
+  # Consoles whose games have a Game Boy cartridge header
+  _gameBoyConsoles = (ConsoleType.GB, ConsoleType.GBC)
+  # Directories changed this recently, in nanoseconds, are read again on
+  # every look up, as coarse timestamps can hide a second change
+  _recentChange = 2 * 10**9
+
   # Directories
   def _consoleTypeDir(self, consoleType:ConsoleType) -> str:
     return os.path.join(self._rootDirectory, consoleType.value)
@@ -61,22 +109,121 @@ class GameLibrary():
     return os.path.join(self._consoleTypeDir(consoleType), fileType.value)
 
 
+  # Index
+  def _index(self, consoleType:ConsoleType,
+      fileType:FileType) -> Dict[str, LibraryFile]:
+    """Files of a directory by name, read again if the directory changed"""
+    filesDir = self._fileTypeDir(consoleType, fileType)
+    try:
+      modified = os.stat(filesDir).st_mtime_ns
+    except FileNotFoundError:
+      modified = None
+    key = (consoleType, fileType)
+    cached = self._indexes.get(key)
+    if cached is not None and cached[0] == modified and \
+        modified is not None and \
+        cached[2] - modified > self._recentChange:
+      return cached[1]
+
+    files = {}
+    if modified is not None:
+      previousFiles = cached[1] if cached is not None else {}
+      parseHeaders = fileType == FileType.GAMES and \
+          consoleType in self._gameBoyConsoles
+      with os.scandir(filesDir) as entries:
+        for entry in entries:
+          # Hidden files are .gitkeep and saves still being written
+          if entry.name.startswith(".") or not entry.is_file():
+            continue
+          stat = entry.stat()
+          previous = previousFiles.get(entry.name)
+          if previous is not None and previous.size == stat.st_size and \
+              previous.modified == stat.st_mtime_ns:
+            files[entry.name] = previous
+          else:
+            files[entry.name] = self._indexFile(entry.path, stat, parseHeaders)
+    self._indexes[key] = (modified, files, time.time_ns())
+    return files
+
+
+  @staticmethod
+  def _indexFile(path:str, stat:os.stat_result,
+      parseHeader:bool) -> LibraryFile:
+    header = None
+    if parseHeader:
+      with open(path, "rb") as f:
+        header = parseGameBoyHeader(f.read(0x150))
+    return LibraryFile(
+      os.path.basename(path),
+      path,
+      stat.st_size,
+      stat.st_mtime_ns,
+      header
+    )
+
+
+  def refresh(self) -> None:
+    """Brings the index of every directory up to date"""
+    for consoleType in ConsoleType:
+      for fileType in FileType:
+        self._index(consoleType, fileType)
+
+
   # Files
+  @property
+  def romIndex(self) -> RomIndex:
+    return self._romIndex
+
+
   def availableFiles(self, consoleType:ConsoleType, fileType:FileType) -> List[str]:
-    filesDir = self._fileTypeDir(consoleType, fileType)
-    return [f for f in os.listdir(filesDir) if f != ".gitkeep" and os.path.isfile(os.path.join(filesDir, f))]
+    return sorted(self._index(consoleType, fileType))
+
+
+  def files(self, consoleType:ConsoleType, fileType:FileType,
+      search:str=None) -> List[LibraryFile]:
+    """Files sorted by name, only those whose name or title has search"""
+    files = self._index(consoleType, fileType)
+    matches = (files[name] for name in sorted(files))
+    if search is None:
+      return list(matches)
+    search = search.lower()
+    return [
+      f for f in matches
+      if search in f.name.lower() or
+        (f.header is not None and search in f.header.title.lower())
+    ]
+
+
+  def fileInfo(self, consoleType:ConsoleType, fileType:FileType,
+      fileName:str) -> LibraryFile:
+    try:
+      return self._index(consoleType, fileType)[fileName]
+    except KeyError:
+      raise FileNotFound(consoleType, fileType, fileName)
+
+
+  def identifyROM(self, consoleType:ConsoleType, fileType:FileType,
+      fileName:str) -> RomFile:
+    """A game or boot ROM with the digest of its content
+
+    Duplicates under different names have the same digest.
+    """
+    return self._romIndex.identify(self.filePath(consoleType, fileType, fileName))
 
 
   def filePath(self, consoleType:ConsoleType, fileType:FileType, fileName:str, ignoreNonExistence:bool=False) -> str:
     fPath = os.path.join(self._fileTypeDir(consoleType, fileType), fileName)
 
-    if os.path.isfile(fPath) or ignoreNonExistence:
+    if ignoreNonExistence or fileName in self._index(consoleType, fileType):
       return fPath
     else:
       raise FileNotFound(consoleType, fileType, fileName)
 
 
   # Magic Methods
-  def __init__(self, rootDirectory="ROMs"):
+  def __init__(self, rootDirectory="ROMs", romIndex:RomIndex=None):
     self._rootDirectory = rootDirectory
-
+    self._romIndex = romIndex if romIndex is not None else RomIndex()
+    # (ConsoleType, FileType) -> (directory mtime, {name: LibraryFile}, when read)
+    self._indexes = {}
+    self.refresh()
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+
+"""
+Counters and histograms, exported in the Prometheus text format
+~~~~~~~~~~~~~~~~~~~
+:copyright: (c) 2019 i-question-this
+:license: GPL-3.0, see LICENSE for more details.
+"""
+import bisect
+import http.server
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+from . import getLogger
+from .autosaver import writeAtomically
+
+logger = getLogger("metrics")
+
+# Upper bounds of histogram buckets, in seconds
+defaultBuckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value:str) -> str:
+  return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _formatNumber(value:float) -> str:
+  if value == math.inf:
+    return "+Inf"
+  return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+
+class Metric(ABC):
+  """A named family of values, one per combination of label values
+
+  Updates come from the event loop, controller workers and encoder threads
+  alike, so every value is changed under the metric's lock.
+  """
+  kind = "untyped"
+
+  # Magic Methods
+  def __init__(self, name:str, help:str, labelNames:Sequence[str]=()):
+    self._name = name
+    self._help = help
+    self._labelNames = tuple(labelNames)
+    self._values = {}
+    self._lock = threading.Lock()
+
+
+  # Properties
+  @property
+  def name(self) -> str:
+    return self._name
+
+
+  @property
+  def help(self) -> str:
+    return self._help
+
+
+  # Labels
+  def _key(self, labels:Dict[str, str]) -> Tuple[str, ...]:
+    if set(labels) != set(self._labelNames):
+      raise ValueError("{} takes labels {}, not {}".format(
+        self._name,
+        self._labelNames,
+        tuple(labels)
+      ))
+    return tuple(str(labels[name]) for name in self._labelNames)
+
+
+  def _labelText(self, key:Tuple[str, ...], extra:str=None) -> str:
+    pairs = ["{}=\"{}\"".format(name, _escape(value))
+        for name, value in zip(self._labelNames, key)]
+    if extra is not None:
+      pairs.append(extra)
+    return "{{{}}}".format(",".join(pairs)) if pairs else ""
+
+
+  # Exporting
+  @abstractmethod
+  def samples(self) -> Iterator[Tuple[str, float]]:
+    """(name with labels, value) of every sample"""
+    pass
+
+
+  def render(self) -> str:
+    lines = [
+      "# HELP {} {}".format(self._name, self._help),
+      "# TYPE {} {}".format(self._name, self.kind)
+    ]
+    lines.extend(
+      "{} {}".format(name, _formatNumber(value))
+      for name, value in self.samples()
+    )
+    return "\n".join(lines)
+
+
+
+class Counter(Metric):
+  """Only ever goes up"""
+  kind = "counter"
+
+  def inc(self, amount:float=1, **labels) -> None:
+    if amount < 0:
+      raise ValueError("Counters can not go down")
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+
+  def value(self, **labels) -> float:
+    with self._lock:
+      return self._values.get(self._key(labels), 0)
+
+
+  def total(self) -> float:
+    """Sum over every label value"""
+    with self._lock:
+      return sum(self._values.values())
+
+
+  def samples(self) -> Iterator[Tuple[str, float]]:
+    with self._lock:
+      values = sorted(self._values.items())
+    for key, value in values:
+      yield self._name + self._labelText(key), value
+
+
+
+class Gauge(Metric):
+  """Read from a function whenever it is exported"""
+  kind = "gauge"
+
+  def __init__(self, name:str, help:str, function:Callable[[], float]):
+    super().__init__(name, help)
+    self._function = function
+
+
+  def value(self) -> float:
+    return self._function()
+
+
+  def samples(self) -> Iterator[Tuple[str, float]]:
+    yield self._name, self._function()
+
+
+
+class Histogram(Metric):
+  """Counts of observations at or below each bucket's upper bound"""
+  kind = "histogram"
+
+  def __init__(self, name:str, help:str, labelNames:Sequence[str]=(),
+      buckets:Sequence[float]=defaultBuckets):
+    super().__init__(name, help, labelNames)
+    self._buckets = tuple(sorted(buckets)) + (math.inf,)
+
+
+  def observe(self, value:float, **labels) -> None:
+    key = self._key(labels)
+    index = bisect.bisect_left(self._buckets, value)
+    with self._lock:
+      values = self._values.get(key)
+      if values is None:
+        # [count per bucket, sum, count]
+        values = self._values[key] = [[0] * len(self._buckets), 0, 0]
+      values[0][index] += 1
+      values[1] += value
+      values[2] += 1
+
+
+  @contextmanager
+  def time(self, **labels) -> Iterator[None]:
+    """Observes how many seconds the with block took"""
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.observe(time.perf_counter() - start, **labels)
+
+
+  def summary(self) -> Tuple[int, float]:
+    """(count, sum) over every label value"""
+    with self._lock:
+      return (
+        sum(values[2] for values in self._values.values()),
+        sum(values[1] for values in self._values.values())
+      )
+
+
+  def samples(self) -> Iterator[Tuple[str, float]]:
+    with self._lock:
+      values = sorted(
+        (key, (list(counts), total, count))
+        for key, (counts, total, count) in self._values.items()
+      )
+    for key, (counts, total, count) in values:
+      cumulative = 0
+      for bound, bucketCount in zip(self._buckets, counts):
+        cumulative += bucketCount
+        yield self._name + "_bucket" + self._labelText(
+          key,
+          "le=\"{}\"".format(_formatNumber(bound))
+        ), cumulative
+      yield self._name + "_sum" + self._labelText(key), total
+      yield self._name + "_count" + self._labelText(key), count
+
+
+
+class MetricsRegistry:
+  """Every metric of the process, by name"""
+  # Magic Methods
+  def __init__(self):
+    self._metrics = {}
+    self._lock = threading.Lock()
+
+
+  # Metrics
+  def _register(self, metric:Metric) -> Metric:
+    with self._lock:
+      existing = self._metrics.get(metric.name)
+      if existing is not None:
+        if type(existing) is not type(metric):
+          raise ValueError("{} is already a {}".format(metric.name, existing.kind))
+        return existing
+      self._metrics[metric.name] = metric
+      return metric
+
+
+  def counter(self, name:str, help:str, labelNames:Sequence[str]=()) -> Counter:
+    return self._register(Counter(name, help, labelNames))
+
+
+  def gauge(self, name:str, help:str, function:Callable[[], float]) -> Gauge:
+    return self._register(Gauge(name, help, function))
+
+
+  def histogram(self, name:str, help:str, labelNames:Sequence[str]=(),
+      buckets:Sequence[float]=defaultBuckets) -> Histogram:
+    return self._register(Histogram(name, help, labelNames, buckets))
+
+
+  def metrics(self) -> List[Metric]:
+    with self._lock:
+      return [self._metrics[name] for name in sorted(self._metrics)]
+
+
+  # Exporting
+  def render(self) -> str:
+    """Every metric in the Prometheus text exposition format"""
+    return "\n".join(metric.render() for metric in self.metrics()) + "\n"
+
+
+  def summary(self) -> List[str]:
+    """One human readable line per metric, totals over every label"""
+    lines = []
+    for metric in self.metrics():
+      if isinstance(metric, Histogram):
+        count, total = metric.summary()
+        lines.append("{}: {} observed, {:.4g} mean".format(
+          metric.name,
+          count,
+          total / count if count else 0
+        ))
+      elif isinstance(metric, Counter):
+        lines.append("{}: {:.6g}".format(metric.name, metric.total()))
+      else:
+        lines.append("{}: {:.6g}".format(metric.name, metric.value()))
+    return lines
+
+
+
+class MetricsExporter:
+  """Exports a registry to a Prometheus text file, a local HTTP endpoint,
+  or both, from background threads
+
+  The file is rewritten atomically every interval seconds, ready for
+  node_exporter's textfile collector. The endpoint serves /metrics on
+  localhost only.
+  """
+  # Magic Methods
+  def __init__(self, registry:"MetricsRegistry", filePath:str=None,
+      port:int=None, interval:float=15):
+    self._registry = registry
+    self._filePath = filePath
+    self._interval = interval
+    self._stopped = threading.Event()
+    self._threads = []
+    self._server = None
+
+    if filePath is not None:
+      self._threads.append(threading.Thread(
+        target=self._writeFile,
+        name="{}-file".format(self.__class__.__name__),
+        daemon=True
+      ))
+    if port is not None:
+      self._server = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", port),
+        self._handlerClass()
+      )
+      self._threads.append(threading.Thread(
+        target=self._server.serve_forever,
+        name="{}-http".format(self.__class__.__name__),
+        daemon=True
+      ))
+    for thread in self._threads:
+      thread.start()
+
+
+  def _handlerClass(self):
+    registry = self._registry
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+      def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] != "/metrics":
+          self.send_error(404)
+          return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+      def log_message(self, format:str, *args) -> None:
+        logger.debug("MetricsHandler: " + format, *args)
+
+    return MetricsHandler
+
+
+  # Exporting
+  def _writeFile(self) -> None:
+    while not self._stopped.is_set():
+      try:
+        writeAtomically(self._filePath, self._registry.render().encode("utf-8"))
+      except Exception:
+        logger.exception("%s: Failed to write '%s'",
+          self.__class__.__name__,
+          self._filePath
+        )
+      self._stopped.wait(self._interval)
+
+
+  def stop(self) -> None:
+    self._stopped.set()
+    if self._server is not None:
+      self._server.shutdown()
+      self._server.server_close()
+    for thread in self._threads:
+      thread.join()
+
+
+
+# Metrics of this process
+registry = MetricsRegistry()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""
+Index of ROM files by content
+~~~~~~~~~~~~~~~~~~~
+:copyright: (c) 2019 i-question-this
+:license: GPL-3.0, see LICENSE for more details.
+"""
+import hashlib
+import os
+from collections import namedtuple
+from . import getLogger
+
+logger = getLogger("storage")
+
+# A ROM file along with the SHA-256 of its content, in hex
+RomFile = namedtuple('RomFile', 'path digest size')
+
+
+class RomIndex:
+  """Identifies ROMs by content, however many files or names they have
+
+  Files are hashed once per size and modification time. The digest only
+  identifies the content, so that duplicates can share what is derived
+  from it, like boot snapshots. ROMs themselves are not shared, PyBoy only
+  opens them by path and keeps battery saves next to that path.
+  """
+  # Bytes hashed at a time
+  chunkSize = 1024 * 1024
+
+  # Magic Methods
+  def __init__(self):
+    # Real path -> (size, mtime, digest)
+    self._digests = {}
+
+
+  # Hashing
+  def digest(self, filePath:str) -> str:
+    """SHA-256 of the file, in hex, hashed again only if it changed"""
+    realPath = os.path.realpath(filePath)
+    stat = os.stat(realPath)
+    cached = self._digests.get(realPath)
+    if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+      return cached[2]
+
+    digest = hashlib.sha256()
+    with open(realPath, "rb") as f:
+      for chunk in iter(lambda: f.read(self.chunkSize), b""):
+        digest.update(chunk)
+    digest = digest.hexdigest()
+    self._digests[realPath] = (stat.st_size, stat.st_mtime_ns, digest)
+    logger.debug("%s: Hashed '%s' as %s",
+      self.__class__.__name__,
+      filePath,
+      digest
+    )
+    return digest
+
+
+  def identify(self, filePath:str) -> RomFile:
+    """The file along with the digest of its content"""
+    digest = self.digest(filePath)
+    return RomFile(filePath, digest, os.path.getsize(filePath))
+
+
+  # Status
+  @property
+  def numberOfDigests(self) -> int:
+    """Files hashed so far"""
+    return len(self._digests)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""
+Profile of one voting round, across threads and processes
+~~~~~~~~~~~~~~~~~~~
+:copyright: (c) 2019 i-question-this
+:license: GPL-3.0, see LICENSE for more details.
+"""
+import cProfile
+import marshal
+import os
+import pstats
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+from . import getLogger
+from .autosaver import writeAtomically
+
+logger = getLogger("metrics")
+
+# The profile enabled on each thread, cProfile only takes one per thread
+_activeProfiles = threading.local()
+
+
+class _ProfileStats:
+  """Stats of a finished profile, in the form pstats.Stats loads"""
+  def __init__(self, stats:dict):
+    self.stats = stats
+
+
+  def create_stats(self) -> None:
+    pass
+
+
+
+class RoundProfile:
+  """cProfile stats of every thread that worked on a round, saved as one file
+
+  cProfile only sees the thread it is enabled on, so the event loop, the
+  controller's worker and the clip encoder each profile themselves into the
+  round's profile. Host processes send their stats over with addStats. The
+  file is a marshalled pstats dump, readable by pstats, snakeviz or
+  flameprof.
+
+  The event loop is one thread shared by every controller, so its profile
+  holds whatever the loop ran during the round, other controllers' rounds
+  included. When rounds of two controllers are profiled at once, the loop
+  is only profiled into the first, and that file also holds the loop and
+  upload time of the second.
+  """
+  # Magic Methods
+  def __init__(self, filePath:str):
+    self._filePath = filePath
+    self._stats = []
+    self._lock = threading.Lock()
+
+
+  # Properties
+  @property
+  def filePath(self) -> str:
+    return self._filePath
+
+
+  # Profiling
+  @contextmanager
+  def thread(self) -> Iterator[None]:
+    """Profiles the calling thread for the with block
+
+    A thread already being profiled stays with the profile it has.
+    """
+    if getattr(_activeProfiles, "profile", None) is not None:
+      logger.warning("%s: %s is already profiled, '%s' leaves it out",
+        self.__class__.__name__,
+        threading.current_thread().name,
+        self._filePath
+      )
+      yield
+      return
+
+    profile = cProfile.Profile()
+    _activeProfiles.profile = profile
+    profile.enable()
+    try:
+      yield
+    finally:
+      profile.disable()
+      _activeProfiles.profile = None
+      profile.create_stats()
+      self.addStats(profile.stats)
+
+
+  def call(self, function, *args, **kwargs):
+    """Calls function with the calling thread profiled"""
+    with self.thread():
+      return function(*args, **kwargs)
+
+
+  def addStats(self, stats:dict) -> None:
+    """Adds the stats of a finished cProfile.Profile"""
+    with self._lock:
+      self._stats.append(stats)
+
+
+  # Saving
+  def save(self) -> str:
+    """Writes every thread's stats merged into one file, returns its path"""
+    with self._lock:
+      stats = pstats.Stats(*(_ProfileStats(s) for s in self._stats))
+    os.makedirs(os.path.dirname(self._filePath) or ".", exist_ok=True)
+    writeAtomically(self._filePath, marshal.dumps(stats.stats))
+    return self._filePath
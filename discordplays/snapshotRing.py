@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""
+Ring of compressed save states kept in memory
+~~~~~~~~~~~~~~~~~~~
+:copyright: (c) 2019 i-question-this
+:license: GPL-3.0, see LICENSE for more details.
+"""
+import zlib
+from collections import deque
+
+# Exceptions for this class
+class NotEnoughSnapshots(Exception):
+  """Thrown when rewinding further back than the snapshots go"""
+  def __init__(self, numberOfSnapshots:int, numberAvailable:int):
+    self.numberOfSnapshots = numberOfSnapshots
+    self.numberAvailable = numberAvailable
+
+
+
+class SnapshotRing:
+  """Newest save states, compressed, within a memory budget
+
+  Pushing a snapshot evicts the oldest ones once there are more than
+  maxSnapshots or they take more than maxBytes. Save states are mostly
+  RAM filled with runs of the same byte, so they compress well even at
+  zlib's fastest level.
+  """
+  compressionLevel = 1
+
+  # Magic Methods
+  def __init__(self, maxBytes:int, maxSnapshots:int):
+    if maxBytes <= 0:
+      raise ValueError("maxBytes must be greater than 0")
+    if maxSnapshots <= 0:
+      raise ValueError("maxSnapshots must be greater than 0")
+
+    self._maxBytes = maxBytes
+    self._maxSnapshots = maxSnapshots
+    self._snapshots = deque()
+    self._numberOfBytes = 0
+
+
+  def __len__(self) -> int:
+    return len(self._snapshots)
+
+
+  # Properties
+  @property
+  def numberOfBytes(self) -> int:
+    """Compressed size of every snapshot held"""
+    return self._numberOfBytes
+
+
+  # Snapshots
+  def push(self, state:bytes) -> None:
+    snapshot = zlib.compress(state, self.compressionLevel)
+    self._snapshots.append(snapshot)
+    self._numberOfBytes += len(snapshot)
+    # The newest snapshot is kept even when it alone is over budget
+    while len(self._snapshots) > 1 and (
+        len(self._snapshots) > self._maxSnapshots or
+        self._numberOfBytes > self._maxBytes):
+      self._numberOfBytes -= len(self._snapshots.popleft())
+
+
+  def rewind(self, numberOfSnapshots:int) -> bytes:
+    """Returns the state numberOfSnapshots back, dropping it and every newer
+    """
+    if numberOfSnapshots < 1:
+      raise ValueError("numberOfSnapshots must be 1 or more")
+    if numberOfSnapshots > len(self._snapshots):
+      raise NotEnoughSnapshots(numberOfSnapshots, len(self._snapshots))
+
+    for _ in range(numberOfSnapshots):
+      snapshot = self._snapshots.pop()
+      self._numberOfBytes -= len(snapshot)
+    return zlib.decompress(snapshot)
+
+
+  def clear(self) -> None:
+    self._snapshots.clear()
+    self._numberOfBytes = 0
@@ -7,26 +7,129 @@ Voting Booth for keeping track of votes
 :license: GPL-3.0, see LICENSE for more details.
 """
 import random
+from typing import Hashable, Iterable, Iterator, Tuple
+from .metrics import registry
+
+# Metrics
+votesChanged = registry.counter(
+  "discordplays_votes_changed_total",
+  "Votes replaced by a later vote of the same user"
+)
+votersPerRound = registry.histogram(
+  "discordplays_voters_per_round",
+  "Users who voted in each closed round",
+  buckets=(1, 2, 5, 10, 25, 50, 100, 250, 1000, 10000)
+)
 
 class VotingBox():
+  """Counts one vote per user, keeping the leader up to date as votes arrive
+
+  Votes are grouped into buckets by how many votes they have, so casting
+  or changing a vote only moves it between neighbouring buckets and the
+  leaders are always the bucket with the highest count.
+  """
   def __init__(self):
     self._userVotes = {}
     self._voteCounts = {}
-  
-  def castVote(self, user, vote):
-    if self._userVotes.get(user) is None:
-      self._userVotes[user] = vote
-      self._voteCounts[vote] = 1 + self._voteCounts.get(vote, 0)
+    # Count -> votes with that many votes, and where each sits in its bucket
+    self._buckets = {}
+    self._bucketIndexes = {}
+    self._leadingCount = 0
+
+
+  # Casting
+  def castVote(self, userId:int, vote:Hashable) -> None:
+    """Casts userId's vote, replacing any vote they cast before"""
+    previousVote = self._userVotes.get(userId)
+    if previousVote == vote:
+      return
+    if previousVote is not None:
+      self._removeVote(previousVote)
+      votesChanged.inc()
+    self._userVotes[userId] = vote
+    self._addVote(vote)
+
+
+  def castVotes(self, votes:Iterable[Tuple[int, Hashable]]) -> None:
+    """Casts many (userId, vote) pairs, later pairs replacing earlier ones"""
+    latestVotes = dict(votes)
+    # Users voting for the first time can be counted in one pass
+    newVoteCounts = {}
+    for userId, vote in latestVotes.items():
+      if userId in self._userVotes:
+        self.castVote(userId, vote)
+      else:
+        self._userVotes[userId] = vote
+        newVoteCounts[vote] = newVoteCounts.get(vote, 0) + 1
+    for vote, count in newVoteCounts.items():
+      self._moveVote(vote, self._voteCounts.get(vote, 0), count)
+
+
+  def _addVote(self, vote:Hashable) -> None:
+    self._moveVote(vote, self._voteCounts.get(vote, 0), 1)
+
+
+  def _removeVote(self, vote:Hashable) -> None:
+    self._moveVote(vote, self._voteCounts[vote], -1)
+
+
+  def _moveVote(self, vote:Hashable, count:int, change:int) -> None:
+    if count > 0:
+      self._takeFromBucket(vote, count)
+    count += change
+    if count > 0:
+      self._voteCounts[vote] = count
+      bucket = self._buckets.setdefault(count, [])
+      self._bucketIndexes[vote] = len(bucket)
+      bucket.append(vote)
+      self._leadingCount = max(self._leadingCount, count)
+    else:
+      del self._voteCounts[vote]
+      del self._bucketIndexes[vote]
+    # A vote only ever leaves the leading bucket for the one below it
+    if self._leadingCount not in self._buckets:
+      self._leadingCount = max(self._leadingCount - 1, 0)
 
-  def voteCounts(self):
+
+  def _takeFromBucket(self, vote:Hashable, count:int) -> None:
+    bucket = self._buckets[count]
+    index = self._bucketIndexes[vote]
+    # Swap with the last vote so removal does not shift the bucket
+    lastVote = bucket.pop()
+    if lastVote != vote:
+      bucket[index] = lastVote
+      self._bucketIndexes[lastVote] = index
+    if not bucket:
+      del self._buckets[count]
+
+
+  # Results
+  @property
+  def numberOfVoters(self) -> int:
+    return len(self._userVotes)
+
+
+  @property
+  def leadingCount(self) -> int:
+    """Number of votes the leaders have, 0 before any votes are cast"""
+    return self._leadingCount
+
+
+  def leader(self) -> Hashable:
+    """A vote with the most votes so far, or None before any are cast"""
+    if self._leadingCount == 0:
+      return None
+    return self._buckets[self._leadingCount][0]
+
+
+  def voteCounts(self) -> Iterator[str]:
     return ("{}: {}".format(k,v) for k,v in self._voteCounts.items())
 
-  def majorityVoteResult(self):
-    # Check that votes were actually cast
-    if len(self._voteCounts) == 0:
-      return None 
-    
-    maxVote = max(self._voteCounts.values())
-    majorityVotes = [k for k,v in self._voteCounts.items() if v == maxVote]
-    return random.choice(majorityVotes)
 
+  def majorityVoteResult(self) -> Hashable:
+    # Check that votes were actually cast
+    if self._leadingCount == 0:
+      return None
+    votersPerRound.observe(len(self._userVotes))
+    # Ties are broken at random
+    return random.choice(self._buckets[self._leadingCount])
@@ -9,11 +9,12 @@ Main for Running the Discord Bot
 """
 from discordplays.discordBot import bot
 
-# Read the token
-with open('token.txt') as f:
-  # Strip the newline chracter
-  token = f.read().rstrip()
+if __name__ == "__main__":
+  # Read the token
+  with open('token.txt') as f:
+    # Strip the newline chracter
+    token = f.read().rstrip()
 
-# Run the bot
-bot.run(token)
+  # Run the bot
+  bot.run(token)
 